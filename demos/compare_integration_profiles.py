@@ -0,0 +1,66 @@
+import time
+import numpy as np
+from models import slip
+import viability as vibly
+
+
+def compare_profiles(grids, p_map, profiles=('fast', 'default', 'precise'),
+                     reference='default', parallel=True):
+    '''
+    Compute the viable set and measure for each integration profile (see
+    slip.INTEGRATION_PROFILES), and report how much Q_V and S_M differ from
+    those computed with the reference profile.
+    returns a dict of results for each profile
+    '''
+    p = p_map.p
+    results = dict()
+    try:
+        for profile in profiles:
+            p_map.p = dict(p, integration_profile=profile)
+            start = time.time()
+            if parallel:
+                Q_map, Q_F = vibly.parcompute_Q_map(grids, p_map)
+            else:
+                Q_map, Q_F = vibly.compute_Q_map(grids, p_map)
+            elapsed = time.time() - start
+            Q_V, S_V = vibly.compute_QV_graph(Q_map, grids)
+            S_M = vibly.project_Q2S(Q_V, grids, proj_opt=np.mean)
+            results[profile] = {'Q_map': Q_map, 'Q_F': Q_F, 'Q_V': Q_V,
+                                'S_M': S_M, 'time': elapsed}
+    finally:
+        p_map.p = p
+
+    ref = results[reference]
+    print('profile    time [s]   Q_V changed   max |dS_M|   mean |dS_M|')
+    for profile, res in results.items():
+        res['Q_V_changed'] = np.count_nonzero(res['Q_V'] != ref['Q_V'])
+        res['S_M_error'] = np.abs(res['S_M'] - ref['S_M'])
+        print('{:10s} {:8.2f}   {:6d} ({:5.2%})   {:10.4f}   {:11.4f}'.format(
+              profile, res['time'], res['Q_V_changed'],
+              res['Q_V_changed']/ref['Q_V'].size, res['S_M_error'].max(),
+              res['S_M_error'].mean()))
+    return results
+
+
+if __name__ == '__main__':
+    p = {'mass': 80.0, 'stiffness': 8200.0, 'resting_length': 1.0,
+         'gravity': 9.81,
+         'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0}
+    x0 = np.array([0, 0.85, 5.5, 0, 0, 0, 0])
+    x0 = slip.reset_leg(x0, p)
+    p['x0'] = x0
+    p['total_energy'] = slip.compute_total_energy(x0, p)
+    p_map = slip.p_map
+    p_map.p = p
+    p_map.x = x0
+    p_map.sa2xp = slip.sa2xp
+    p_map.xp2s = slip.xp2s
+
+    # a coarse grid, for exploration
+    s_grid = np.linspace(0.1, 1, 61)
+    s_grid = (s_grid[:-1],)
+    a_grid = (np.linspace(-10/180*np.pi, 70/180*np.pi, 41),)
+    grids = {'states': s_grid, 'actions': a_grid}
+
+    compare_profiles(grids, p_map)
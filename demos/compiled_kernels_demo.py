@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import numpy as np
+
+# run from anywhere, also without installing vibly (pip install -e .)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from models import slip, nslip, daslip, parslip  # noqa: E402
+import models.kernels as kernels  # noqa: E402
+
+
+def compare_kernels(model, x0, p, aoa_range, height_range, n_samples=20,
+                    seed=0):
+    '''
+    Simulate steps from apex states of different heights, and with different
+    angles of attack, with the step function of the model (solve_ivp) and the
+    kernels of models/kernels.py (see slip.kernel_step), and report how far
+    the final states differ, whether both agree on failure, and the average
+    time per step.
+    returns (max. |dx|, number of failure mismatches, speedup)
+    '''
+    rng = np.random.default_rng(seed)
+    samples = [(rng.uniform(*height_range), rng.uniform(*aoa_range))
+               for _ in range(n_samples)]
+
+    def initial_state(height, aoa):
+        q = dict(p, angle_of_attack=aoa)
+        x = x0.copy()
+        x[1] = height
+        return model.reset_leg(x, q), q
+
+    if kernels.HAVE_NUMBA:  # compile before timing
+        slip.kernel_step(*initial_state(*samples[0]), model.kernel_params)
+
+    error = 0
+    mismatches = 0
+    time_step = 0
+    time_kernel = 0
+    for height, aoa in samples:
+        x, q = initial_state(height, aoa)
+        start = time.time()
+        x_step = model.step(x.copy(), q, final_only=True).y[:, -1]
+        time_step += time.time() - start
+        start = time.time()
+        x_kernel = slip.kernel_step(x.copy(), q, model.kernel_params)
+        time_kernel += time.time() - start
+        error = max(error, np.max(np.abs(x_step - x_kernel)))
+        mismatches += (model.check_failure(x_step)
+                       != model.check_failure(x_kernel))
+
+    speedup = time_step/time_kernel
+    print('{:8s} {:10.2e} {:10d} {:12.2f} {:12.2f} {:8.1f}x'.format(
+          model.__name__.split('.')[-1], error, mismatches,
+          1e3*time_step/n_samples, 1e3*time_kernel/n_samples, speedup))
+    return error, mismatches, speedup
+
+
+if __name__ == '__main__':
+    if kernels.HAVE_NUMBA:
+        print('kernels compiled with numba')
+    else:
+        print('numba is not installed: kernels run in pure python, and'
+              ' the compiled integration profile falls back to solve_ivp.')
+    print('model     max |dx|  fail diff  step [ms]  kernel [ms]  speedup')
+
+    # * SLIP
+    p = {'mass': 80.0, 'stiffness': 8200.0, 'resting_length': 1.0,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0}
+    x0 = slip.reset_leg(np.array([0, 0.85, 5.5, 0, 0, 0, 0]), p)
+    compare_kernels(slip, x0, p, (10/180*np.pi, 50/180*np.pi), (0.6, 1.2))
+
+    # * nSLIP
+    p = {'mass': 80.0, 'stiffness': 705.0, 'resting_angle': 17/18*np.pi,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi, 'upper_leg': 0.5,
+         'lower_leg': 0.5}
+    x0 = nslip.reset_leg(np.array([0, 0.85, 5.5, 0, 0, 0, 0]), p)
+    p['total_energy'] = nslip.compute_total_energy(x0, p)
+    compare_kernels(nslip, x0, p, (10/180*np.pi, 50/180*np.pi), (0.6, 1.2))
+
+    # * DASLIP and PARSLIP, with the open-loop force of a limit cycle
+    limit_cycle_options = {'search_initial_state': False,
+                           'state_index': 1,
+                           'state_search_width': 0.5,
+                           'search_parameter': True,
+                           'parameter_name': 'angle_of_attack',
+                           'parameter_search_width': np.pi*0.25}
+    p = {'mass': 80, 'stiffness': 8200.0, 'resting_length': 0.9,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0.1, 'actuator_force': [],
+         'actuator_force_period': 10, 'activation_delay': 0.0,
+         'activation_amplification': 1.0,
+         'constant_normalized_damping': 0.75,
+         'linear_normalized_damping': 3.5,
+         'linear_minimum_normalized_damping': 0.05,
+         'swing_velocity': 0, 'angle_of_attack_offset': 0,
+         'swing_extension_velocity': 0, 'swing_leg_length_offset': 0}
+    x0 = np.array([0, 1.00, 5.5, 0, 0, 0, p['actuator_resting_length'],
+                   0, 0, 0])
+    x0 = daslip.reset_leg(x0, p)
+    p['total_energy'] = daslip.compute_total_energy(x0, p)
+    x0, p = daslip.create_open_loop_trajectories(x0, p, limit_cycle_options)
+    compare_kernels(daslip, x0, p, (p['angle_of_attack'] - 0.1,
+                                    p['angle_of_attack'] + 0.1), (0.9, 1.1))
+
+    p = {'mass': 80, 'stiffness': 8200.0, 'resting_length': 0.9,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0.1, 'actuator_force': [],
+         'actuator_force_period': 10, 'activation_delay': 0.0,
+         'activation_amplification': 1.0, 'damping': 0.1}
+    x0 = parslip.reset_leg(np.array([0, 1.00, 5.5, 0, 0, 0, 0.]), p)
+    p['total_energy'] = parslip.compute_total_energy(x0, p)
+    x0, p = parslip.create_open_loop_trajectories(x0, p, limit_cycle_options)
+    compare_kernels(parslip, x0, p, (p['angle_of_attack'] - 0.1,
+                                     p['angle_of_attack'] + 0.1), (0.9, 1.1))
@@ -45,6 +45,11 @@ if __name__ == '__main__':
     # * this is used to catch corner cases, and is not important for most
     # * systems with interesting dynamics
     # * setting `check_grid` to False will omit Q_on_grid
+    # * `batch=True` simulates the whole grid at once (see
+    # * hovership.p_map_batch). This is much faster, but the landing states
+    # * differ from those of solve_ivp by up to about 1e-3, and a few
+    # * transitions land in a neighbouring bin, so the map differs from the
+    # * stored results
     # Q_map, Q_F, Q_on_grid = vibly.parcompute_Q_map(grids, p_map,
     #                                                check_grid=True)
     Q_map, Q_F, Q_on_grid = vibly.compute_Q_map(grids, p_map, check_grid=True)
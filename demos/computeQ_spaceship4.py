@@ -50,8 +50,10 @@ if __name__ == '__main__':
     # * Q_on_grid is a helper grid, which marks if a state has not moved
     # * this is used to catch corner cases, and is not important for most systems
     # * setting `check_grid` to False will omit Q_on_grid
+    # * `batch` simulates each chunk at once (see spaceship4.p_map_batch). On
+    # * this grid, the result is identical to simulating each point separately
     Q_map, Q_F, Q_on_grid = vibly.parcompute_Q_map(grids, p_map, check_grid=True,
-                                                verbose=1)
+                                                verbose=1, batch=True)
     # * compute_QV computes the viable set and viability kernel
     Q_V, S_V = vibly.compute_QV(Q_map, grids, ~Q_F, Q_on_grid=Q_on_grid)
 
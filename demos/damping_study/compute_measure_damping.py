@@ -17,9 +17,7 @@ if __name__ == '__main__':
     print("WARNING: Computing this data from scratch can take a LONG time (~20 hours on a 24-core machine). We have pre-computed the data for the Guinea Fowl parameter fit (used in 'A Little Damping goes a Long Way' in RSBL), which can be found here: https://doi.org/10.5061/dryad.44j0zpcbj.")
     print("We encourage you to use this code, which may have improvements/bugfixes, and simply copy/paste the dataset from `data/guineafowl` into the `data` folder.")
 
-    def compute_viability(x0, p, name, visualise=False):
-
-        # * Solve for nominal open-loop limit-cycle
+    def setup_viability(x0, p):
 
         # * Set-up P maps for computations
         p_map = model.poincare_map
@@ -63,40 +61,23 @@ if __name__ == '__main__':
         # a_grid = (a_grid_aoa, a_grid_amp)
 
         grids = {'states': s_grid, 'actions': a_grid}
-
-        # * compute transition matrix and boolean matrix of failures
-        Q_map, Q_F = vibly.parcompute_Q_map(grids, p_map, verbose=1)
-
-        # * compute viable sets
-        Q_V, S_V = vibly.compute_QV(Q_map, grids)
-        # * compute the measure in state-space
-        S_M = vibly.project_Q2S(Q_V, grids, proj_opt=np.mean)
-        # * map the measure to Q-space
-        Q_M = vibly.map_S2Q(Q_map, S_M, s_grid, Q_V=Q_V)
-
-        print("non-failing portion of Q: " + str(np.sum(~Q_F)/Q_F.size))
-        print("viable portion of Q: " + str(np.sum(Q_V)/Q_V.size))
-
-        # * save data
-        if not os.path.exists(name):
-            os.makedirs(name)
+        return p_map, grids
+
+    def visualise(name, damping, data):
+        print("non-failing portion of Q: "
+              + str(np.sum(~data['Q_F'])/data['Q_F'].size))
+        print("viable portion of Q: "
+              + str(np.sum(data['Q_V'])/data['Q_V'].size))
+        print("SAVING FIGURE")
+        print(" ")
         filename = name+'/'+name+'_'+'{:.4f}'.format(damping)
-
-        data2save = {"grids": grids, "Q_map": Q_map, "Q_F": Q_F, "Q_V": Q_V,
-                    "Q_M": Q_M, "S_M": S_M, "p": p, "x0": x0}
-        outfile = open(filename+'.pickle', 'wb')
-        pickle.dump(data2save, outfile)
-        outfile.close()
-
-        if visualise:
-            print("SAVING FIGURE")
-            print(" ")
-            plt.figure()
-            plt.imshow(S_M, origin='lower', vmin=0, vmax=1, cmap='viridis')
-            plt.title('bird ' + name)
-            plt.savefig(filename+'.pdf', format='pdf')
-            # plt.show()  # to just see it on the fly
-            plt.close()
+        plt.figure()
+        plt.imshow(data['S_M'], origin='lower', vmin=0, vmax=1,
+                   cmap='viridis')
+        plt.title('bird ' + name)
+        plt.savefig(filename+'.pdf', format='pdf')
+        # plt.show()  # to just see it on the fly
+        plt.close()
 
     # * load parameters
     infile = open('guineafowl_fit.pickle', 'rb')
@@ -171,13 +152,20 @@ if __name__ == '__main__':
     outfile.close()
 
     # * For each damping coefficient, compute the viability measure
-    for damping in damping_vals:
-        p['constant_normalized_damping'] = damping
-        # p['linear_normalized_damping'] = damping
-        # use the commented line if you want to try a damping force that scales
-        # linearly with muscle-activation (f(t)). Not discussed in the paper.
-        p['x0'] = x0.copy()
-        compute_viability(x0, p, name, visualise=True)
+    # * All damping values share one pool of workers, and each result is
+    # * saved as soon as it is done, in name/name_<damping>.pickle. Rerunning
+    # * the script only computes the damping values which are not saved yet.
+    # * `monotone` is not passed: the viability kernel is not known to grow or
+    # * shrink with damping over this range, and a warm start (see
+    # * vibly.sweep) based on a wrong assumption silently gives wrong results.
+    p['x0'] = x0.copy()
+    p_map, grids = setup_viability(x0, p)
+    vibly.sweep(grids, p_map, 'constant_normalized_damping', damping_vals,
+                path=name, name=name, verbose=1,
+                callback=lambda damping, data: visualise(name, damping, data))
+    # use 'linear_normalized_damping' if you want to try a damping force that
+    # scales linearly with muscle-activation (f(t)). Not discussed in the
+    # paper.
 
     time_elapsed = tictoc.toc()
     print("time elapsed for one set of damping values: "
@@ -23,6 +23,9 @@ def gravity(x, p):
     return np.max([0, x[0]])*p['gravity']
 
 def mass_matrix(x, p):
+    '''
+    Mass matrix, for a state x (4, ) or an (N, 4) array of states
+    '''
     # unpack
     m1 = p['m1']
     m2 = p['m2']
@@ -33,8 +36,10 @@ def mass_matrix(x, p):
     b = m2*l2**2
     c = m2*l1*l2
 
-    return np.array([[a + b + 2*c*np.cos(x[1]), b + c*np.cos(x[1])],
-                     [b + c*np.cos(x[1]), b]])
+    cos_q2 = np.cos(x[..., 1])
+    return np.stack([np.stack([a + b + 2*c*cos_q2, b + c*cos_q2], -1),
+                     np.stack([b + c*cos_q2, np.full_like(cos_q2, b)], -1)],
+                    -2)
 
 
 def coriolis(x, p):
@@ -44,8 +49,11 @@ def coriolis(x, p):
 
     c = m2*l1*l2
 
-    return np.array([[-c*np.sin(x[1])*x[3], -c*np.sin(x[0]+x[1])],
-                     [c*np.sin(x[1])*x[2], 0]])
+    zero = np.zeros_like(x[..., 0])
+    return np.stack([np.stack([-c*np.sin(x[..., 1])*x[..., 3],
+                               -c*np.sin(x[..., 0]+x[..., 1])], -1),
+                     np.stack([c*np.sin(x[..., 1])*x[..., 2], zero], -1)],
+                    -2)
 
 
 def gravitational(x, p):
@@ -58,8 +66,22 @@ def gravitational(x, p):
     d = g*m1*l1 + g*m2*l1
     e = g*m2*l2
 
-    return np.array([-d*np.sin(x[0]) - e*np.sin(x[0]+x[1]),
-                    e*np.sin(x[0]+x[1])])
+    return np.stack([-d*np.sin(x[..., 0]) - e*np.sin(x[..., 0]+x[..., 1]),
+                     e*np.sin(x[..., 0]+x[..., 1])], -1)
+
+
+def accelerations(x, p, torque):
+    '''
+    Joint accelerations M^-1 (tau - C qdot - G), for a state x (4, ) or an
+    (N, 4) array of states, with the torque applied at the second joint
+    '''
+    M = mass_matrix(x, p)
+    C = coriolis(x, p)
+    G = gravitational(x, p)
+    torque = np.asarray(torque, dtype=float)
+    tau = np.stack([np.zeros_like(torque), torque], -1)
+    rhs = tau - np.einsum('...ij,...j->...i', C, x[..., 2:]) - G
+    return np.linalg.solve(M, rhs[..., None])[..., 0]
 
 
 def p_map(x, p):
@@ -71,14 +93,9 @@ def p_map(x, p):
     if check_failure(x, p):
         return x, True
 
-    M = mass_matrix(x, p)
-    C = coriolis(x, p)
-    G = gravitational(x, p)
-
-    tau = np.array([0, p['torque']])
-
-    # TODO check dimensions
-    x += p['t_step']*np.stack(x[0:2], np.linalg.solve(M, tau - C*x[2:] - G))
+    # semi-implicit Euler: update velocities first, then positions with them
+    x[2:] += p['t_step']*accelerations(x, p, p['torque'])
+    x[0:2] += p['t_step']*x[2:]
 
     return x, check_failure(x, p)
 
@@ -98,13 +115,60 @@ def check_failure(x, p):
 
 
 # Viability functions
-def sa2xp(state_action, x, p):
-    x = np.atleast_1d(state_action[:p['n_states']])
-    p['torque'] = np.atleast_1d(state_action[p['n_states']:])
-    p['torque'] = np.min([p['u_upper_bound'], p['torque']])  # bound torque
-    p['torque'] = np.max([p['u_lower_bound'], p['torque']])
-    return x, p
+def sa2xp(state_action, p):
+    x = np.array(state_action[:p['n_states']], dtype=float)
+    p_new = p.copy()
+    p_new['torque'] = np.clip(state_action[p['n_states']],
+                              p['u_lower_bound'],
+                              p['u_upper_bound'])  # bound torque
+    return x, p_new
 
 
 def xp2s(x, p):
     return x
+
+
+# * Batched versions, to evaluate many state-action pairs at once
+# (used by viability.compute_Q_map with batch=True)
+
+def p_map_batch(X, P):
+    '''
+    Same as p_map, for an (N, 4) array of states. P['torque'] is either an
+    (N, ) array of per-point torques, or the same for all points.
+    returns X_next (N, 4) and failed (N, )
+    '''
+    X = np.array(X, dtype=float)
+    failed = check_failure_batch(X, P)
+    ok = np.flatnonzero(~failed)
+    torque = np.broadcast_to(np.asarray(P['torque'], dtype=float),
+                             X.shape[:1])[ok]
+    X[ok, 2:] += P['t_step']*accelerations(X[ok], P, torque)
+    X[ok, 0:2] += P['t_step']*X[ok, 2:]
+    failed[ok] = check_failure_batch(X[ok], P)
+    return X, failed
+
+
+def check_failure_batch(X, P):
+    '''
+    Same as check_failure, for an (N, 4) array of states
+    '''
+    elbow_height = P['l1']*np.cos(X[:, 0])
+    end_eff_height = elbow_height + P['l2']*np.cos(X[:, 1]-X[:, 0])
+    return (elbow_height <= 0.0) | (end_eff_height <= 0.0)
+
+
+def sa2xp_batch(SA, p):
+    SA = np.asarray(SA, dtype=float)
+    P = p.copy()
+    P['torque'] = np.clip(SA[:, p['n_states']], p['u_lower_bound'],
+                          p['u_upper_bound'])  # bound torque
+    return SA[:, :p['n_states']].copy(), P
+
+
+def xp2s_batch(X, P):
+    return X
+
+
+p_map.batch = p_map_batch
+sa2xp.batch = sa2xp_batch
+xp2s.batch = xp2s_batch
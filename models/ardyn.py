@@ -4,6 +4,8 @@ import numpy as np
 Arbitrary dynamics
 x_{k+1} = map(x_k, p)
 p: dict of parameters. For convenience, actions are also stored here.
+p['nonlinear'](x, p) should index states along the last axis of x, so that it
+also works on (N, n) arrays in p_map_batch.
 '''
 
 # map: x_k+1, failed = map
@@ -34,10 +36,48 @@ def check_failure(x, p):
 
 # Viability functions
 
-def sa2xp(state_action, x, p):
-    x = np.atleast_2d(state_action[:p['n_states']])
-    p['actions'] = np.atleast_2d(state_action[p['n_states']:])
-    return x, p
+def sa2xp(state_action, p):
+    x = np.array(state_action[:p['n_states']], dtype=float)
+    p_new = p.copy()
+    p_new['actions'] = np.atleast_1d(state_action[p['n_states']:])
+    return x, p_new
 
 def xp2s(x, p):
-    return x
\ No newline at end of file
+    return x
+
+# * Batched versions, to evaluate many state-action pairs at once
+# (used by viability.compute_Q_map with batch=True)
+
+def p_map_batch(X, P):
+    '''
+    Same as p_map, for an (N, n) array of states. P['actions'] is either an
+    (N, n) array of per-point actions, or the same for all points.
+    returns X_next (N, n) and failed (N, )
+    '''
+    X = np.array(X, dtype=float)
+    failed = check_failure_batch(X, P)
+    ok = ~failed
+    P_ok = dict(P, actions=np.broadcast_to(P['actions'], X.shape)[ok])
+    X[ok] += (np.minimum(1, np.linalg.norm(X[ok], axis=1))[:, None]
+              * P['nonlinear'](X[ok], P_ok) + P_ok['actions'])
+    failed[ok] = check_failure_batch(X[ok], P)
+    return X, failed
+
+def check_failure_batch(X, P):
+    '''
+    Same as check_failure, for an (N, n) array of states
+    '''
+    return np.linalg.norm(X, axis=1) > P['fail_bound']
+
+def sa2xp_batch(SA, p):
+    SA = np.asarray(SA, dtype=float)
+    P = p.copy()
+    P['actions'] = SA[:, p['n_states']:]
+    return SA[:, :p['n_states']].copy(), P
+
+def xp2s_batch(X, P):
+    return X
+
+p_map.batch = p_map_batch
+sa2xp.batch = sa2xp_batch
+xp2s.batch = xp2s_batch
@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.integrate as integrate
 import models.slip as slip
+import models.kernels as kernels
 
 
 def feasible(x, p):
@@ -17,35 +18,33 @@ def poincare_map(x, p):
     '''
     Wrapper function for step function, returning only x_next, and -1 if failed
     Essentially, the Poincare map.
+    If p is a tuple of N parameter dicts, x is an (n, N) array of states, one
+    for each parameter set, see slip.map_parameter_sets.
     '''
     if type(p) is dict:
         if not feasible(x, p):
             return x, True  # return failed if foot starts underground
-        sol = step(x, p)
-        return sol.y[:, -1], check_failure(sol.y[:, -1])
+        profile = getattr(poincare_map, 'integration_profile', None)
+        x_next = slip.compiled_step(x, p, kernel_params, profile)
+        if x_next is None:
+            x_next = step(x, p, final_only=True, profile=profile).y[:, -1]
+        return x_next, check_failure(x_next)
     elif type(p) is tuple:
-        vector_of_x = np.zeros(x.shape)  # initialize result array
-        vector_of_fail = np.zeros(x.shape[1])
-        # TODO: for shorthand, allow just a single tuple to be passed in
-        # this can be done easily with itertools
-        for idx, p0 in enumerate(p):
-            if not feasible(x, p):
-                vector_of_x[:, idx] = x[:, idx]
-                vector_of_fail[idx] = True
-            else:
-                sol = step(x[:, idx], p0)  # p0 = p[idx]
-                vector_of_x[:, idx] = sol.y[:, -1]
-                vector_of_fail[idx] = check_failure(sol.y[:, -1])
-        return (vector_of_x, vector_of_fail)
+        # one parameter dict per column of x
+        return slip.map_parameter_sets(poincare_map, x, p)
     else:
         print("WARNING: I got a parameter type that I don't understand.")
         return x, True
 
 
-def step(x0, p, prev_sol=None):
+def step(x0, p, prev_sol=None, final_only=False, profile=None):
     '''
     Take one step from apex to apex/failure.
     returns a sol object from integrate.solve_ivp, with all phases
+    - final_only: only keep the final state of each phase instead of the
+    whole trajectory, e.g. to compute transition maps
+    - profile: integration profile (see slip.INTEGRATION_PROFILES), used if
+    p has no 'integration_profile' entry
     '''
 
     # * nested functions - scroll down to step code * #
@@ -63,13 +62,18 @@ def step(x0, p, prev_sol=None):
     ACTUATOR_RESTING_LENGTH = p['actuator_resting_length']
     SWING_VELOCITY = p['swing_velocity']
     SWING_EXTENSION_VELOCITY = p['swing_extension_velocity']
-    ACTUATOR_PERIOD = p['actuator_force_period']
     VISCOUS_DAMPING = p['constant_normalized_damping']*p['stiffness']
     ACTIVE_DAMPING = p['linear_normalized_damping']
     MIN_DAMPING = (p['linear_normalized_damping'] * p['mass']
                    * p['gravity'] * p['linear_minimum_normalized_damping'])
-    DELAY = p['activation_delay']  # can also be negative
-    AMPLI = p['activation_amplification']
+    # open-loop actuator force as a function of time (None if there is none)
+    ACTUATOR_FORCE = slip.actuator_force_lookup(p)
+    OPTIONS = slip.integration_options(
+        p.get('integration_profile', profile))
+    # without swing leg motion, flight phases are solved in closed form
+    ANALYTIC_FLIGHT = (p.get('analytic_flight', OPTIONS['analytic_flight'])
+                       and SWING_VELOCITY == 0
+                       and SWING_EXTENSION_VELOCITY == 0)
 
     # @jit(nopython=True)
     def flight_dynamics(t, x):
@@ -93,25 +97,22 @@ def step(x0, p, prev_sol=None):
     def stance_dynamics(t, x):
         # stance dynamics
         alpha = np.arctan2(x[1] - x[5], x[0] - x[4]) - np.pi/2.0
-        spring_damper_actuator_forces = compute_leg_forces(t, x, p)
-
-        spring_force = spring_damper_actuator_forces[0]
-        actuator_damping_force = spring_damper_actuator_forces[1]
-        actuator_force = spring_damper_actuator_forces[2]
+        # same as compute_leg_forces, with constants unpacked
+        spring_length = np.hypot(x[0]-x[4], x[1]-x[5]) - x[6]
+        spring_force = -STIFFNESS*(spring_length-SPRING_RESTING_LENGTH)
+        if ACTUATOR_FORCE is not None:
+            actuator_force = ACTUATOR_FORCE(t)
+        else:
+            actuator_force = 0
+        actuator_damping_force = spring_force - actuator_force
 
         ldotdot = spring_force/MASS
         xdotdot = -ldotdot*np.sin(alpha)
         ydotdot = ldotdot*np.cos(alpha) - GRAVITY
 
-        actuator_damping_coefficient = (p['constant_normalized_damping']
-                                        * p['stiffness'])
-        damping_min = (p['linear_normalized_damping']
-                       * p['mass']*p['gravity']
-                       * p['linear_minimum_normalized_damping'])
-        damping_val = (actuator_force
-                       * p['linear_normalized_damping'])
-        actuator_damping_coefficient += np.maximum([damping_min],
-                                                  [damping_val])[0]
+        actuator_damping_coefficient = (VISCOUS_DAMPING
+                                        + max(MIN_DAMPING,
+                                              actuator_force*ACTIVE_DAMPING))
 
         ladot = -actuator_damping_force/actuator_damping_coefficient
         wadot = actuator_force*ladot
@@ -176,11 +177,15 @@ def step(x0, p, prev_sol=None):
         t0 = 0  # starting time
 
     # * FLIGHT: simulate till touchdown
-    events = [fall_event, touchdown_event]
-    sol = integrate.solve_ivp(flight_dynamics,
-                              t_span=[t0, t0 + MAX_TIME],
-                              y0=x0, events=events,
-                              max_step=0.001)
+    if ANALYTIC_FLIGHT:
+        sol = slip.ballistic_flight(x0, t0, p, ['fall', 'touchdown'], MAX_TIME,
+                                    max_step=0.001, fall_direction=0,
+                                    final_only=final_only)
+    else:
+        events = [fall_event, touchdown_event]
+        sol = slip.solve_phase(flight_dynamics, t_span=[t0, t0 + MAX_TIME],
+                               y0=x0, events=events, max_step=0.001,
+                               final_only=final_only, options=OPTIONS)
 
     # TODO Put each part of the step into a list, so you can concat them
     # TODO programmatically, and reduce code length.
@@ -195,11 +200,10 @@ def step(x0, p, prev_sol=None):
     # * STANCE: simulate till liftoff
     events = [fall_event, liftoff_event]
     x0 = sol.y[:, -1]
-    sol2 = integrate.solve_ivp(stance_dynamics,
-                               t_span=[sol.t[-1], sol.t[-1] + MAX_TIME],
-                               y0=x0,
-                               events=events,
-                               max_step=0.001)
+    sol2 = slip.solve_phase(stance_dynamics,
+                            t_span=[sol.t[-1], sol.t[-1] + MAX_TIME], y0=x0,
+                            events=events, max_step=0.001,
+                            final_only=final_only, options=OPTIONS)
 
     # if you fell, stop now
     if sol2.t_events[0].size != 0:  # if empty
@@ -214,13 +218,17 @@ def step(x0, p, prev_sol=None):
         return sol
 
     # * FLIGHT: simulate till apex
-    events = [fall_event, apex_event]
     x0 = reset_leg(sol2.y[:, -1], p)
-    sol3 = integrate.solve_ivp(flight_dynamics,
-                               t_span=[sol2.t[-1], sol2.t[-1] + MAX_TIME],
-                               y0=x0,
-                               events=events,
-                               max_step=0.001)
+    if ANALYTIC_FLIGHT:
+        sol3 = slip.ballistic_flight(x0, sol2.t[-1], p, ['fall', 'apex'],
+                                     MAX_TIME, max_step=0.001,
+                                     fall_direction=0, final_only=final_only)
+    else:
+        events = [fall_event, apex_event]
+        sol3 = slip.solve_phase(flight_dynamics,
+                                t_span=[sol2.t[-1], sol2.t[-1] + MAX_TIME],
+                                y0=x0, events=events, max_step=0.001,
+                                final_only=final_only, options=OPTIONS)
 
     # concatenate all solutions
     sol.t = np.concatenate((sol.t, sol2.t, sol3.t))
@@ -339,6 +347,28 @@ def reset_leg(x, p):
     return x
 
 
+def kernel_params(p):
+    '''
+    Setup of the compiled kernels for the DASLIP, see slip.kernel_step.
+    returns None with swing leg motion, which the kernels do not support.
+    '''
+    if p['swing_velocity'] != 0 or p['swing_extension_velocity'] != 0:
+        return None
+    base_length = p['actuator_resting_length']+p['swing_leg_length_offset']
+    params = kernels.pack_params(
+        gravity=p['gravity'], mass=p['mass'], stiffness=p['stiffness'],
+        resting_length=p['resting_length'],
+        viscous_damping=p['constant_normalized_damping']*p['stiffness'],
+        active_damping=p['linear_normalized_damping'],
+        min_damping=(p['linear_normalized_damping'] * p['mass']
+                     * p['gravity'] * p['linear_minimum_normalized_damping']),
+        period=p['actuator_force_period'],
+        amplification=p['activation_amplification'],
+        leg_angle=p['angle_of_attack']+p['angle_of_attack_offset'],
+        leg_length=p['resting_length']+base_length, base_length=base_length)
+    return kernels.DASLIP, params, 0.001, 0.001, 5
+
+
 def compute_total_energy(x, p):
     # TODO: make this accept a trajectory, and output parts as well
     energy = 0
@@ -509,17 +539,10 @@ def compute_leg_forces(t, x, p):
     that is in series with the leg spring.
     '''
 
-    ACTUATOR_PERIOD = p['actuator_force_period']
-    DELAY = p['activation_delay']  # can also be negative
-    AMPLI = p['activation_amplification']
-
     spring_force = compute_leg_force(x, p)
-    actuator_force = 0
-    if np.shape(p['actuator_force'])[0] > 0:
-        actuator_force = np.interp(t, p['actuator_force'][0, :]+DELAY,
-                                   p['actuator_force'][1, :],
-                                   period=ACTUATOR_PERIOD)
-        actuator_force *= AMPLI
+    actuator_force_lookup = slip.actuator_force_lookup(p)
+    if actuator_force_lookup is not None:
+        actuator_force = actuator_force_lookup(t)
     else:
         actuator_force = 0
 
@@ -1,5 +1,6 @@
 import numpy as np
 import scipy.integrate as integrate
+import models.integration as integration
 '''
 A spaceship attempting to reconnoitre the surface of a planet.
 However, the planet has an unusual gravitational field... getting too close to
@@ -111,3 +112,79 @@ def xp2s(x, p):
     s: high-level state used in the viability algorithms
     '''
     return x
+
+
+# * Batched versions, to evaluate many state-action pairs at once (used by
+# * viability.compute_Q_map with batch=True). Instead of calling solve_ivp for
+# * each pair, all of them are integrated together with a fixed-step RK4
+# * scheme (see models/integration.py), using BATCH_STEPS steps per control
+# * time-step.
+BATCH_STEPS = 20
+
+
+def p_map_batch(X, P):
+    '''
+    Same as p_map, for an (N, 1) array of states. P['thrust'] is either an
+    (N, ) array of per-point thrusts, or the same for all points, and so are
+    the parameters in p_map_batch.per_point.
+    returns X_next (N, 1) and failed (N, )
+    '''
+    X = np.array(X, dtype=float)
+    failed = check_failure_batch(X, P)
+    ok = np.flatnonzero(~failed)
+
+    def per_point(val):
+        return np.broadcast_to(val, X.shape[:1])[ok]
+
+    THRUST = np.minimum(per_point(P['max_thrust']), per_point(P['thrust']))
+    BASE_GRAVITY = per_point(P['base_gravity'])
+    GRAVITY = per_point(P['gravity'])
+    MAX_TIME = 1.0/P['control_frequency']
+    CEILING = per_point(P['ceiling'])
+
+    # * idx: which of the simulated points are still being integrated
+    def continuous_dynamics(t, X, idx):
+        grav_field = (np.maximum(0, np.tanh(0.75*(CEILING[idx] - X[:, 0])))
+                      * GRAVITY[idx])
+        return (- BASE_GRAVITY[idx] - grav_field + THRUST[idx])[:, None]
+
+    def ceiling_event(t, X, idx):
+        return X[:, 0] - CEILING[idx]
+    ceiling_event.direction = 1
+
+    _, X_ok, _ = integration.integrate_batch(
+        continuous_dynamics, 0.0, X[ok], MAX_TIME/BATCH_STEPS, MAX_TIME,
+        events=[ceiling_event])
+    # * same as in p_map, cap at the CEILING
+    X[ok] = np.minimum(X_ok, CEILING[:, None])
+    failed[ok] = check_failure_batch(X[ok], P)
+    return X, failed
+
+
+def check_failure_batch(X, P):
+    '''
+    Same as check_failure, for an (N, 1) array of states
+    '''
+    return X[:, 0] < 0
+
+
+def sa2xp_batch(SA, p):
+    '''
+    Same as sa2xp, for an (N, 2) array of state-actions
+    returns X (N, 1) and P, with per-point thrusts
+    '''
+    SA = np.asarray(SA, dtype=float)
+    P = p.copy()
+    P['thrust'] = SA[:, p['n_states']]
+    return SA[:, :p['n_states']].copy(), P
+
+
+def xp2s_batch(X, P):
+    return X
+
+
+p_map.batch = p_map_batch
+# parameters which p_map_batch also accepts as (N, ) arrays
+p_map_batch.per_point = ('max_thrust', 'base_gravity', 'gravity', 'ceiling')
+sa2xp.batch = sa2xp_batch
+xp2s.batch = xp2s_batch
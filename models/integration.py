@@ -0,0 +1,111 @@
+'''
+Batched fixed-step integration with event detection, to simulate many
+initial conditions (e.g. a whole chunk of a Q-map grid) at once.
+'''
+
+import numpy as np
+
+
+def crossed(g_old, g_new, direction=0):
+    '''
+    Detect zero-crossings of event values over a step, with the same
+    convention as scipy.integrate.solve_ivp
+    '''
+    up = (g_old <= 0) & (g_new >= 0)
+    down = (g_old >= 0) & (g_new <= 0)
+    if direction > 0:
+        return up
+    if direction < 0:
+        return down
+    return up | down
+
+
+def hermite(s, h, X0, F0, X1, F1):
+    '''
+    Cubic Hermite interpolation at s in [0, 1] over a step of length h, from
+    state X0 with derivative F0 to state X1 with derivative F1
+    '''
+    s = s[:, None]
+    return ((2*s**3 - 3*s**2 + 1)*X0 + (s**3 - 2*s**2 + s)*h[:, None]*F0
+            + (-2*s**3 + 3*s**2)*X1 + (s**3 - s**2)*h[:, None]*F1)
+
+
+def integrate_batch(rhs, t0, X0, dt, max_time, events=(), n_refine=50):
+    '''
+    Integrate a batch of initial states X0 (N, n) with a fixed-step RK4 scheme,
+    until each row hits an event, or max_time has passed.
+    - rhs(t, X, idx): vectorized dynamics. t (M, ) and X (M, n) are the times
+    and states of the rows idx of the batch that are still running.
+    - events: list of event functions event(t, X, idx), returning (M, ) arrays.
+    Same as for solve_ivp, an optional `direction` attribute selects the
+    direction of zero-crossings. All events are terminal.
+    Event times are refined by bisection on the cubic Hermite interpolant of
+    the step, and the state is interpolated at the event time.
+    returns
+    t: (N, ) final times
+    X: (N, n) final states
+    event_idx: (N, ) index of the event that stopped each row, -1 if none did
+    '''
+    X = np.array(X0, dtype=float)
+    t = np.array(np.broadcast_to(t0, X.shape[:1]), dtype=float)
+    t_end = t + max_time
+    event_idx = np.full(X.shape[0], -1)
+    running = np.arange(X.shape[0])
+    G = [event(t, X, running) for event in events]
+
+    while running.size:
+        tr = t[running]
+        Xr = X[running]
+        h = np.minimum(dt, t_end[running] - tr)
+
+        F0 = rhs(tr, Xr, running)
+        K2 = rhs(tr + h/2, Xr + h[:, None]/2*F0, running)
+        K3 = rhs(tr + h/2, Xr + h[:, None]/2*K2, running)
+        K4 = rhs(tr + h, Xr + h[:, None]*K3, running)
+        X_new = Xr + h[:, None]/6*(F0 + 2*K2 + 2*K3 + K4)
+        t_new = tr + h
+        G_new = [event(t_new, X_new, running) for event in events]
+
+        # find the earliest event in this step, for each row
+        s_hit = np.full(running.size, np.inf)
+        which = np.full(running.size, -1)
+        F1 = None
+        for idx, event in enumerate(events):
+            hit = np.flatnonzero(crossed(G[idx], G_new[idx],
+                                         getattr(event, 'direction', 0)))
+            if hit.size == 0:
+                continue
+            if F1 is None:
+                F1 = rhs(t_new, X_new, running)
+            lo = np.zeros(hit.size)
+            hi = np.ones(hit.size)
+            g_lo = G[idx][hit]
+            for _ in range(n_refine):
+                mid = (lo + hi)/2
+                g_mid = event(tr[hit] + mid*h[hit],
+                              hermite(mid, h[hit], Xr[hit], F0[hit],
+                                      X_new[hit], F1[hit]),
+                              running[hit])
+                left = g_lo*g_mid <= 0
+                hi = np.where(left, mid, hi)
+                lo = np.where(left, lo, mid)
+                g_lo = np.where(left, g_lo, g_mid)
+            earlier = hi < s_hit[hit]
+            s_hit[hit[earlier]] = hi[earlier]
+            which[hit[earlier]] = idx
+
+        hit = np.flatnonzero(which >= 0)
+        if hit.size:
+            t_new[hit] = tr[hit] + s_hit[hit]*h[hit]
+            X_new[hit] = hermite(s_hit[hit], h[hit], Xr[hit], F0[hit],
+                                 X_new[hit], F1[hit])
+            event_idx[running[hit]] = which[hit]
+        t[running] = t_new
+        X[running] = X_new
+
+        # round-off: stop when (almost) at t_end
+        finished = (which >= 0) | (t_end[running] - t_new <= dt*1e-9)
+        G = [g[~finished] for g in G_new]
+        running = running[~finished]
+
+    return t, X, event_idx
@@ -0,0 +1,290 @@
+'''
+Compiled kernels for the SLIP-family models (slip, nslip, daslip, parslip):
+the flight and stance dynamics, event functions, and a fixed-step RK4
+integrator loop with event detection, to simulate a single step to its final
+state. The kernels are compiled with numba if it is installed; otherwise
+HAVE_NUMBA is False, and the models fall back to their pure NumPy/scipy
+step functions (see the 'compiled' integration profile in slip.py).
+'''
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        '''
+        Stand-in for numba.njit: return the function unchanged
+        '''
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+# models
+SLIP, NSLIP, DASLIP, PARSLIP = 0, 1, 2, 3
+
+# phases of a step: flight until touchdown, stance, flight until apex
+TOUCHDOWN_FLIGHT, STANCE, APEX_FLIGHT = 0, 1, 2
+
+# entries of the parameter array, see `pack_params`
+PARAMS = ('gravity', 'mass', 'stiffness', 'resting_length',
+          'actuator_resting_length', 'leg_angle', 'leg_length',
+          'base_length', 'upper_leg', 'lower_leg', 'resting_angle',
+          'viscous_damping', 'active_damping', 'min_damping', 'damping',
+          'period', 'amplification')
+(GRAVITY, MASS, STIFFNESS, RESTING_LENGTH, ACTUATOR_RESTING_LENGTH,
+ LEG_ANGLE, LEG_LENGTH, BASE_LENGTH, UPPER_LEG, LOWER_LEG, RESTING_ANGLE,
+ VISCOUS_DAMPING, ACTIVE_DAMPING, MIN_DAMPING, DAMPING, PERIOD,
+ AMPLIFICATION) = range(len(PARAMS))
+
+
+def pack_params(**kwargs):
+    '''
+    Pack model parameters (by the names in PARAMS) into a float array, as
+    used by the kernels. Unused entries are nan.
+    '''
+    params = np.full(len(PARAMS), np.nan)
+    for name, val in kwargs.items():
+        params[PARAMS.index(name)] = val
+    return params
+
+
+@njit(cache=True)
+def actuator_force(t, params, times, values):
+    '''
+    Periodic open-loop actuator force, from the periodic table built by
+    slip.actuator_force_lookup (empty if there is no actuator force)
+    '''
+    if times.size == 0:
+        return 0.0
+    return np.interp(t % params[PERIOD], times, values)*params[AMPLIFICATION]
+
+
+@njit(cache=True)
+def flight_rhs(x):
+    '''
+    Flight dynamics of all models (without swing leg motion), apart from
+    gravity, which is added by `rhs`
+    '''
+    xdot = np.zeros_like(x)
+    xdot[0] = x[2]
+    xdot[1] = x[3]
+    xdot[4] = x[2]
+    xdot[5] = x[3]
+    return xdot
+
+
+@njit(cache=True)
+def stance_rhs(model, t, x, params, times, values):
+    alpha = np.arctan2(x[1] - x[5], x[0] - x[4]) - np.pi/2.0
+    leg_length = np.hypot(x[0]-x[4], x[1]-x[5])
+    xdot = np.zeros_like(x)
+    xdot[0] = x[2]
+    xdot[1] = x[3]
+    if model == SLIP:
+        spring_length = leg_length - params[ACTUATOR_RESTING_LENGTH]
+        leg_force = (params[STIFFNESS]/params[MASS]
+                     * (params[RESTING_LENGTH] - spring_length))
+        xdot[2] = -leg_force*np.sin(alpha)
+        xdot[3] = leg_force*np.cos(alpha) - params[GRAVITY]
+    elif model == NSLIP:
+        upper = params[UPPER_LEG]
+        lower = params[LOWER_LEG]
+        beta = np.arccos((upper**2+lower**2 - leg_length**2)
+                         / (2*upper*lower))
+        tau = params[STIFFNESS]*(params[RESTING_ANGLE] - beta)
+        leg_force = leg_length/(upper*lower) * tau / np.sin(beta)
+        xdot[2] = -leg_force/params[MASS]*np.sin(alpha)
+        xdot[3] = leg_force/params[MASS]*np.cos(alpha) - params[GRAVITY]
+    elif model == DASLIP:
+        spring_length = leg_length - x[6]
+        spring_force = -params[STIFFNESS]*(spring_length
+                                           - params[RESTING_LENGTH])
+        act_force = actuator_force(t, params, times, values)
+        actuator_damping_force = spring_force - act_force
+        ldotdot = spring_force/params[MASS]
+        xdot[2] = -ldotdot*np.sin(alpha)
+        xdot[3] = ldotdot*np.cos(alpha) - params[GRAVITY]
+        actuator_damping_coefficient = (
+            params[VISCOUS_DAMPING]
+            + max(params[MIN_DAMPING], act_force*params[ACTIVE_DAMPING]))
+        ladot = -actuator_damping_force/actuator_damping_coefficient
+        xdot[6] = ladot
+        xdot[7] = act_force*ladot
+        xdot[8] = actuator_damping_force*ladot
+    else:  # PARSLIP
+        act_force = actuator_force(t, params, times, values)
+        spring_compression = params[RESTING_LENGTH]-(
+            leg_length - params[ACTUATOR_RESTING_LENGTH])
+        gamma = np.arctan2(x[5]-x[1], x[4]-x[0]) - np.arctan2(x[3], x[2])
+        r_dot = np.hypot(x[2], x[3])*np.cos(gamma)
+        sd_force = (params[STIFFNESS]*spring_compression
+                    * (1 + params[DAMPING]*r_dot))
+        leg_force = (act_force + sd_force)/params[MASS]
+        xdot[2] = -leg_force*np.sin(alpha)
+        xdot[3] = leg_force*np.cos(alpha) - params[GRAVITY]
+    return xdot
+
+
+@njit(cache=True)
+def rhs(model, phase, t, x, params, times, values):
+    if phase == STANCE:
+        return stance_rhs(model, t, x, params, times, values)
+    xdot = flight_rhs(x)
+    xdot[3] = -params[GRAVITY]
+    return xdot
+
+
+@njit(cache=True)
+def n_events(model, phase):
+    if phase == STANCE and model != DASLIP:
+        return 3  # fall, liftoff, reversal
+    return 2
+
+
+@njit(cache=True)
+def event_value(model, phase, k, x, params):
+    '''
+    Event k of a phase: 0 is always falling, then
+    touchdown (flight until touchdown), liftoff and reversal (stance),
+    or apex (flight until apex)
+    '''
+    if k == 0:
+        return x[1]
+    if phase == TOUCHDOWN_FLIGHT:
+        if model == NSLIP:
+            return x[5]
+        return x[5] - x[-1]
+    if phase == APEX_FLIGHT:
+        return x[3]
+    if k == 2:
+        return x[2] + 1e-5  # for numerics, allow for "straight up"
+    leg_length = np.hypot(x[0]-x[4], x[1]-x[5])
+    if model == NSLIP:
+        return leg_length - params[RESTING_LENGTH]**2
+    if model == DASLIP:
+        return leg_length - x[6] - params[RESTING_LENGTH]
+    return (leg_length - params[ACTUATOR_RESTING_LENGTH]
+            - params[RESTING_LENGTH])
+
+
+@njit(cache=True)
+def event_direction(model, phase, k):
+    if k == 0:
+        return -1 if model == SLIP else 0
+    if phase == TOUCHDOWN_FLIGHT:
+        return -1
+    if phase == APEX_FLIGHT:
+        return 0
+    if k == 2:
+        return -1
+    return 1
+
+
+@njit(cache=True)
+def crossed(g_old, g_new, direction):
+    up = g_old <= 0 and g_new >= 0
+    down = g_old >= 0 and g_new <= 0
+    if direction > 0:
+        return up
+    if direction < 0:
+        return down
+    return up or down
+
+
+@njit(cache=True)
+def hermite(s, h, x0, f0, x1, f1):
+    return ((2*s**3 - 3*s**2 + 1)*x0 + (s**3 - 2*s**2 + s)*h*f0
+            + (-2*s**3 + 3*s**2)*x1 + (s**3 - s**2)*h*f1)
+
+
+@njit(cache=True)
+def integrate_phase(model, phase, t, x, dt, max_time, params, times,
+                    values):
+    '''
+    Integrate one phase with a fixed-step RK4 scheme until the first event,
+    refined by bisection on the cubic Hermite interpolant of the step.
+    returns the final time and state, and the index of the event (-1 if
+    max_time was reached)
+    '''
+    t_end = t + max_time
+    n = n_events(model, phase)
+    g_old = np.empty(n)
+    g_new = np.empty(n)
+    for k in range(n):
+        g_old[k] = event_value(model, phase, k, x, params)
+    while True:
+        h = min(dt, t_end - t)
+        k1 = rhs(model, phase, t, x, params, times, values)
+        k2 = rhs(model, phase, t + h/2, x + h/2*k1, params, times, values)
+        k3 = rhs(model, phase, t + h/2, x + h/2*k2, params, times, values)
+        k4 = rhs(model, phase, t + h, x + h*k3, params, times, values)
+        x_new = x + h/6*(k1 + 2*k2 + 2*k3 + k4)
+        for k in range(n):
+            g_new[k] = event_value(model, phase, k, x_new, params)
+
+        s_hit = np.inf
+        which = -1
+        f1 = k1  # only evaluated if an event occurs
+        for k in range(n):
+            if not crossed(g_old[k], g_new[k],
+                           event_direction(model, phase, k)):
+                continue
+            if which < 0 and s_hit == np.inf:
+                f1 = rhs(model, phase, t + h, x_new, params, times, values)
+            lo = 0.0
+            hi = 1.0
+            g_lo = g_old[k]
+            for _ in range(50):
+                mid = (lo + hi)/2
+                g_mid = event_value(model, phase, k,
+                                    hermite(mid, h, x, k1, x_new, f1),
+                                    params)
+                if g_lo*g_mid <= 0:
+                    hi = mid
+                else:
+                    lo = mid
+                    g_lo = g_mid
+            if hi < s_hit:
+                s_hit = hi
+                which = k
+        if which >= 0:
+            return t + s_hit*h, hermite(s_hit, h, x, k1, x_new, f1), which
+
+        t = t + h
+        x = x_new
+        g_old[:] = g_new
+        if t_end - t <= dt*1e-9:
+            return t, x, -1
+
+
+@njit(cache=True)
+def step(model, x0, params, times, values, flight_step, stance_step,
+         max_time):
+    '''
+    Take one step from apex to apex/failure, same as the `step` function of
+    the model, but only return the final time and state.
+    '''
+    t, x, event = integrate_phase(model, TOUCHDOWN_FLIGHT, 0.0,
+                                  x0.astype(np.float64), flight_step,
+                                  max_time, params, times, values)
+    if event == 0:  # fell
+        return t, x
+
+    t, x, event = integrate_phase(model, STANCE, t, x, stance_step,
+                                  max_time, params, times, values)
+    # fell (parslip only stops for falling, but not for reversal)
+    if event == 0 or (event == 2 and model != PARSLIP):
+        return t, x
+
+    # reset leg
+    x[4] = x[0] + np.sin(params[LEG_ANGLE])*params[LEG_LENGTH]
+    x[5] = x[1] - np.cos(params[LEG_ANGLE])*params[LEG_LENGTH]
+    if model == DASLIP:
+        x[6] = params[BASE_LENGTH]
+    t, x, event = integrate_phase(model, APEX_FLIGHT, t, x, flight_step,
+                                  max_time, params, times, values)
+    return t, x
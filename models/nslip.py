@@ -1,5 +1,7 @@
 import numpy as np
 import scipy.integrate as integrate
+import models.slip as slip
+import models.kernels as kernels
 # from numba import jit
 
 # Parameter set:
@@ -27,38 +29,33 @@ def p_map(x, p):
     '''
     Wrapper function for step function, returning only x_next, and -1 if failed
     Essentially, the Poincare map.
+    If p is a tuple of N parameter dicts, x is an (n, N) array of states, one
+    for each parameter set, see slip.map_parameter_sets.
     '''
     if type(p) is dict:
         if not feasible(x, p):
             return x, True # return failed if foot starts underground
-        sol = step(x, p)
-        # if len(sol.t_events) < 7:
-        #     # print(len(sol.t_events))
-        #     return sol.y[:, -1], True
-        return sol.y[:, -1], check_failure(sol.y[:, -1])
+        profile = getattr(p_map, 'integration_profile', None)
+        x_next = slip.compiled_step(x, p, kernel_params, profile)
+        if x_next is None:
+            x_next = step(x, p, final_only=True, profile=profile).y[:, -1]
+        return x_next, check_failure(x_next)
     elif type(p) is tuple:
-        vector_of_x = np.zeros(x.shape) # initialize result array
-        vector_of_fail = np.zeros(x.shape[1])
-        # TODO: for shorthand, allow just a single tuple to be passed in
-        # this can be done easily with itertools
-        for idx, p0 in enumerate(p):
-            if not feasible(x, p):
-                vector_of_x[:, idx] = x[:, idx]
-                vector_of_fail[idx] = True
-            else:
-                sol = step(x[:, idx], p0) # p0 = p[idx]
-                vector_of_x[:, idx] = sol.y[:, -1]
-                vector_of_fail[idx] = check_failure(sol.y[:, -1])
-        return vector_of_x, vector_of_fail
+        # one parameter dict per column of x
+        return slip.map_parameter_sets(p_map, x, p)
     else:
         print("WARNING: I got a parameter type that I don't understand.")
         return (x, True)
 
 
-def step(x0, p, prev_sol = None):
+def step(x0, p, prev_sol = None, final_only = False, profile = None):
     '''
     Take one step from apex to apex/failure.
     returns a sol object from integrate.solve_ivp, with all phases
+    - final_only: only keep the final state of each phase instead of the
+    whole trajectory, e.g. to compute transition maps
+    - profile: integration profile (see slip.INTEGRATION_PROFILES), used if
+    p has no 'integration_profile' entry
     '''
 
     # * nested functions - scroll down to step code * #
@@ -76,6 +73,10 @@ def step(x0, p, prev_sol = None):
     TOTAL_ENERGY = p['total_energy']
     # SPECIFIC_STIFFNESS = p['stiffness'] / p['mass']
     MAX_TIME = 5
+    OPTIONS = slip.integration_options(
+        p.get('integration_profile', profile))
+    # flight phases in closed form, instead of numerically integrated
+    ANALYTIC_FLIGHT = p.get('analytic_flight', OPTIONS['analytic_flight'])
 
     # @jit(nopython=True)
     def flight_dynamics(t, x):
@@ -172,9 +173,14 @@ def step(x0, p, prev_sol = None):
         t0 = 0 # starting time
 
     # * FLIGHT: simulate till touchdown
-    events = [fall_event, touchdown_event]
-    sol = integrate.solve_ivp(flight_dynamics,
-        t_span = [t0, t0 + MAX_TIME], y0 = x0, events = events, max_step = 0.01)
+    if ANALYTIC_FLIGHT:
+        sol = slip.ballistic_flight(x0, t0, p, ['fall', 'touchdown'], MAX_TIME,
+                                    fall_direction=0, final_only=final_only)
+    else:
+        events = [fall_event, touchdown_event]
+        sol = slip.solve_phase(flight_dynamics, t_span = [t0, t0 + MAX_TIME],
+                               y0 = x0, events = events, max_step = 0.01,
+                               final_only=final_only, options=OPTIONS)
 
     # TODO Put each part of the step into a list, so you can concat them
     # TODO programmatically, and reduce code length.
@@ -189,9 +195,10 @@ def step(x0, p, prev_sol = None):
     # * STANCE: simulate till liftoff
     events = [fall_event, liftoff_event, reversal_event]
     x0 = sol.y[:, -1]
-    sol2 = integrate.solve_ivp(stance_dynamics,
-        t_span = [sol.t[-1], sol.t[-1] + MAX_TIME], y0 = x0,
-        events=events, max_step=0.0005)
+    sol2 = slip.solve_phase(stance_dynamics,
+                            t_span = [sol.t[-1], sol.t[-1] + MAX_TIME],
+                            y0 = x0, events=events, max_step=0.0005,
+                            final_only=final_only, options=OPTIONS)
 
     # if you fell, stop now
     if sol2.t_events[0].size != 0 or sol2.t_events[2].size != 0: # if empty
@@ -206,12 +213,17 @@ def step(x0, p, prev_sol = None):
         return sol
 
     # * FLIGHT: simulate till apex
-    events = [fall_event, apex_event]
-
     x0 = reset_leg(sol2.y[:, -1], p)
-    sol3 = integrate.solve_ivp(flight_dynamics,
-            t_span = [sol2.t[-1], sol2.t[-1] + MAX_TIME], y0 = x0,
-            events=events, max_step=0.01)
+    if ANALYTIC_FLIGHT:
+        sol3 = slip.ballistic_flight(x0, sol2.t[-1], p, ['fall', 'apex'],
+                                     MAX_TIME, fall_direction=0,
+                                     final_only=final_only)
+    else:
+        events = [fall_event, apex_event]
+        sol3 = slip.solve_phase(flight_dynamics,
+                                t_span = [sol2.t[-1], sol2.t[-1] + MAX_TIME],
+                                y0 = x0, events=events, max_step=0.01,
+                                final_only=final_only, options=OPTIONS)
 
     # concatenate all solutions
     sol.t = np.concatenate((sol.t, sol2.t, sol3.t))
@@ -253,6 +265,19 @@ def reset_leg(x, p):
     x[5] = x[1] - np.cos(p['angle_of_attack'])*resting_length
     return x
 
+def kernel_params(p):
+    '''
+    Setup of the compiled kernels for the nSLIP, see slip.kernel_step
+    '''
+    resting_length = (np.sqrt(p['upper_leg']**2 + p['lower_leg']**2
+                    - 2*p['upper_leg']*p['lower_leg']*np.cos(p['resting_angle']) ))
+    params = kernels.pack_params(
+        gravity=p['gravity'], mass=p['mass'], stiffness=p['stiffness'],
+        resting_length=resting_length, upper_leg=p['upper_leg'],
+        lower_leg=p['lower_leg'], resting_angle=p['resting_angle'],
+        leg_angle=p['angle_of_attack'], leg_length=resting_length)
+    return kernels.NSLIP, params, 0.01, 0.0005, 5
+
 def compute_total_energy(x, p):
     # TODO: make this accept a trajectory, and output parts as well
     # resting_length = (np.sqrt(p['upper_leg']**2 + p['lower_leg']**2
@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.integrate as integrate
 import models.slip as slip
+import models.kernels as kernels
 
 
 def feasible(x, p):
@@ -17,35 +18,33 @@ def poincare_map(x, p):
     '''
     Wrapper function for step function, returning only x_next, and -1 if failed
     Essentially, the Poincare map.
+    If p is a tuple of N parameter dicts, x is an (n, N) array of states, one
+    for each parameter set, see slip.map_parameter_sets.
     '''
     if type(p) is dict:
         if not feasible(x, p):
             return x, True  # return failed if foot starts underground
-        sol = step(x, p)
-        return sol.y[:, -1], check_failure(sol.y[:, -1])
+        profile = getattr(poincare_map, 'integration_profile', None)
+        x_next = slip.compiled_step(x, p, kernel_params, profile)
+        if x_next is None:
+            x_next = step(x, p, final_only=True, profile=profile).y[:, -1]
+        return x_next, check_failure(x_next)
     elif type(p) is tuple:
-        vector_of_x = np.zeros(x.shape)  # initialize result array
-        vector_of_fail = np.zeros(x.shape[1])
-        # TODO: for shorthand, allow just a single tuple to be passed in
-        # this can be done easily with itertools
-        for idx, p0 in enumerate(p):
-            if not feasible(x, p):
-                vector_of_x[:, idx] = x[:, idx]
-                vector_of_fail[idx] = True
-            else:
-                sol = step(x[:, idx], p0)  # p0 = p[idx]
-                vector_of_x[:, idx] = sol.y[:, -1]
-                vector_of_fail[idx] = check_failure(sol.y[:, -1])
-        return (vector_of_x, vector_of_fail)
+        # one parameter dict per column of x
+        return slip.map_parameter_sets(poincare_map, x, p)
     else:
         print("WARNING: I got a parameter type that I don't understand.")
         return x, True
 
 
-def step(x0, p, prev_sol=None):
+def step(x0, p, prev_sol=None, final_only=False, profile=None):
     '''
     Take one step from apex to apex/failure.
     returns a sol object from integrate.solve_ivp, with all phases
+    - final_only: only keep the final state of each phase instead of the
+    whole trajectory, e.g. to compute transition maps
+    - profile: integration profile (see slip.INTEGRATION_PROFILES), used if
+    p has no 'integration_profile' entry
     '''
 
     # * nested functions - scroll down to step code * #
@@ -59,10 +58,14 @@ def step(x0, p, prev_sol=None):
     MASS = p['mass']
     SPRING_RESTING_LENGTH = p['resting_length']
     STIFFNESS = p['stiffness']
-    ACTUATOR_PERIOD = p['actuator_force_period']
     DAMPING = compute_damping_coefficient(p)
-    DELAY = p['activation_delay']  # can also be negative
-    AMPLI = p['activation_amplification']
+    ACTUATOR_RESTING_LENGTH = p['actuator_resting_length']
+    # open-loop actuator force as a function of time (None if there is none)
+    ACTUATOR_FORCE = slip.actuator_force_lookup(p)
+    OPTIONS = slip.integration_options(
+        p.get('integration_profile', profile))
+    # flight phases in closed form, instead of numerically integrated
+    ANALYTIC_FLIGHT = p.get('analytic_flight', OPTIONS['analytic_flight'])
 
     # @jit(nopython=True)
     def flight_dynamics(t, x):
@@ -75,12 +78,8 @@ def step(x0, p, prev_sol=None):
         '''
 
         # * actuator_force
-        if np.shape(p['actuator_force'])[0] > 0:
-            act_force = np.interp(t,
-                                p['actuator_force'][0, :]+DELAY,
-                                p['actuator_force'][1, :],  # force
-                                period=ACTUATOR_PERIOD)
-            act_force *= AMPLI
+        if ACTUATOR_FORCE is not None:
+            act_force = ACTUATOR_FORCE(t)
         else:
             act_force = 0
 
@@ -89,8 +88,11 @@ def step(x0, p, prev_sol=None):
         # see A COMPUTATIONALLY EFFICIENT MUSCLE MODEL (Millard & Delp 2012)
         # For this, DAMPING * velocity should result in a dimensionless number
 
-        spring_compression = SPRING_RESTING_LENGTH-compute_spring_length(x, p)
-        r_dot = compute_spring_velocity(x, p)
+        # (compute_spring_length and compute_spring_velocity, inlined)
+        spring_compression = SPRING_RESTING_LENGTH-(
+            np.hypot(x[0]-x[4], x[1]-x[5]) - ACTUATOR_RESTING_LENGTH)
+        gamma = np.arctan2(x[5]-x[1], x[4]-x[0]) - np.arctan2(x[3], x[2])
+        r_dot = np.hypot(x[2], x[3])*np.cos(gamma)
         sd_force = STIFFNESS*(spring_compression)*(1 + DAMPING*r_dot)
 
         return act_force+sd_force
@@ -170,11 +172,14 @@ def step(x0, p, prev_sol=None):
         t0 = 0  # starting time
 
     # * FLIGHT: simulate till touchdown
-    events = [fall_event, touchdown_event]
-    sol = integrate.solve_ivp(flight_dynamics,
-                              t_span=[t0, t0 + MAX_TIME],
-                              y0=x0, events=events,
-                              max_step=0.01)
+    if ANALYTIC_FLIGHT:
+        sol = slip.ballistic_flight(x0, t0, p, ['fall', 'touchdown'], MAX_TIME,
+                                    fall_direction=0, final_only=final_only)
+    else:
+        events = [fall_event, touchdown_event]
+        sol = slip.solve_phase(flight_dynamics, t_span=[t0, t0 + MAX_TIME],
+                               y0=x0, events=events, max_step=0.01,
+                               final_only=final_only, options=OPTIONS)
 
     # TODO Put each part of the step into a list, so you can concat them
     # TODO programmatically, and reduce code length.
@@ -189,11 +194,10 @@ def step(x0, p, prev_sol=None):
     # * STANCE: simulate till liftoff
     events = [fall_event, liftoff_event, reversal_event]
     x0 = sol.y[:, -1]
-    sol2 = integrate.solve_ivp(stance_dynamics,
-                               t_span=[sol.t[-1], sol.t[-1] + MAX_TIME],
-                               y0=x0,
-                               events=events,
-                               max_step=0.001)
+    sol2 = slip.solve_phase(stance_dynamics,
+                            t_span=[sol.t[-1], sol.t[-1] + MAX_TIME], y0=x0,
+                            events=events, max_step=0.001,
+                            final_only=final_only, options=OPTIONS)
 
     # if you fell, stop now
     if sol2.t_events[0].size != 0:  # if empty
@@ -208,13 +212,17 @@ def step(x0, p, prev_sol=None):
         return sol
 
     # * FLIGHT: simulate till apex
-    events = [fall_event, apex_event]
     x0 = reset_leg(sol2.y[:, -1], p)
-    sol3 = integrate.solve_ivp(flight_dynamics,
-                               t_span=[sol2.t[-1], sol2.t[-1] + MAX_TIME],
-                               y0=x0,
-                               events=events,
-                               max_step=0.01)
+    if ANALYTIC_FLIGHT:
+        sol3 = slip.ballistic_flight(x0, sol2.t[-1], p, ['fall', 'apex'],
+                                     MAX_TIME, fall_direction=0,
+                                     final_only=final_only)
+    else:
+        events = [fall_event, apex_event]
+        sol3 = slip.solve_phase(flight_dynamics,
+                                t_span=[sol2.t[-1], sol2.t[-1] + MAX_TIME],
+                                y0=x0, events=events, max_step=0.01,
+                                final_only=final_only, options=OPTIONS)
 
     # concatenate all solutions
     sol.t = np.concatenate((sol.t, sol2.t, sol3.t))
@@ -342,6 +350,22 @@ def reset_leg(x, p):
     return x
 
 
+def kernel_params(p):
+    '''
+    Setup of the compiled kernels for the PARSLIP, see slip.kernel_step
+    '''
+    params = kernels.pack_params(
+        gravity=p['gravity'], mass=p['mass'], stiffness=p['stiffness'],
+        resting_length=p['resting_length'],
+        actuator_resting_length=p['actuator_resting_length'],
+        damping=compute_damping_coefficient(p),
+        period=p['actuator_force_period'],
+        amplification=p['activation_amplification'],
+        leg_angle=p['angle_of_attack'],
+        leg_length=p['resting_length'] + p['actuator_resting_length'])
+    return kernels.PARSLIP, params, 0.01, 0.001, 1
+
+
 def compute_total_energy(x, p):
     # TODO: make this accept a trajectory, and output parts as well
     if len(x.shape) == 1:
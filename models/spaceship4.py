@@ -1,5 +1,6 @@
 import numpy as np
 import scipy.integrate as integrate
+import models.integration as integration
 
 '''
 space attempting to reconnoitre the surface of a planet.
@@ -83,3 +84,70 @@ def sa2xp(state_action, p):
 
 def xp2s(x, p):
     return x
+
+
+# * Batched versions, to evaluate many state-action pairs at once (used by
+# * viability.compute_Q_map with batch=True), integrated together with a
+# * fixed-step RK4 scheme, see hovership.p_map_batch
+BATCH_STEPS = 20
+
+
+def p_map_batch(X, P):
+    '''
+    Same as p_map, for an (N, 2) array of states. The thrusts in P are either
+    (N, ) arrays of per-point values, or the same for all points.
+    returns X_next (N, 2) and failed (N, )
+    '''
+    X = np.array(X, dtype=float)
+    failed = check_failure_batch(X, P)
+    ok = np.flatnonzero(~failed)
+
+    THRUST_V = np.broadcast_to(P['thrust_vertical'], X.shape[:1])[ok]
+    THRUST_H = np.broadcast_to(P['thrust_horizontal'], X.shape[:1])[ok]
+    WIND = P['wind']
+    GRAVITY = P['gravity']
+    BASE_GRAVITY = P['base_gravity']
+    CEILING = P['ceiling']
+    MAX_TIME = 1.0/P['control_frequency']
+
+    def continuous_dynamics(t, X, idx):
+        grav_field = np.maximum(0, np.tanh(0.75*(CEILING - X[:, 0])))*GRAVITY
+        return np.column_stack((- BASE_GRAVITY - grav_field + THRUST_V[idx],
+                                WIND*np.sin(X[:, 0]*np.pi) + THRUST_H[idx]))
+
+    def ceiling_event(t, X, idx):
+        return X[:, 0] - CEILING
+    ceiling_event.direction = 1
+
+    _, X[ok], _ = integration.integrate_batch(
+        continuous_dynamics, 0.0, X[ok], MAX_TIME/BATCH_STEPS, MAX_TIME,
+        events=[ceiling_event])
+    failed[ok] = check_failure_batch(X[ok], P)
+    return X, failed
+
+
+def check_failure_batch(X, P):
+    '''
+    Same as check_failure, for an (N, 2) array of states
+    '''
+    return ((X[:, 0] >= P['x0_upper_bound'])
+            | (X[:, 0] < P['x0_lower_bound'])
+            | (X[:, 1] > P['x1_upper_bound'])
+            | (X[:, 1] < P['x1_lower_bound']))
+
+
+def sa2xp_batch(SA, p):
+    SA = np.asarray(SA, dtype=float)
+    P = p.copy()
+    P['thrust_vertical'] = SA[:, p['n_states']]
+    P['thrust_horizontal'] = SA[:, p['n_states'] + 1]
+    return SA[:, :p['n_states']].copy(), P
+
+
+def xp2s_batch(X, P):
+    return X
+
+
+p_map.batch = p_map_batch
+sa2xp.batch = sa2xp_batch
+xp2s.batch = xp2s_batch
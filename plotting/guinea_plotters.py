@@ -183,7 +183,7 @@ def compute_measure_postep(data, trajecs, S_M = None):
     # state in low-dim state-space
     SN = [sys.xp2s_y_xdot(xn, data['p']) for xn in XN]
     # digitalize, to bin index
-    SN_dig = [vibly.digitize_s(sn, data['grids']['states']) for sn in SN]
+    SN_dig = vibly.digitize_s_batch(SN, data['grids']['states'])
     # measure of each point
     SNM = [interp_measure(sbin, S_M,
                                  data['grids']) for sbin in SN_dig]
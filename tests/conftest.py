@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from models import daslip, parslip
+
+LIMIT_CYCLE_OPTIONS = {'search_initial_state': False,
+                       'state_index': 2,
+                       'state_search_width': 2.0,
+                       'search_parameter': True,
+                       'parameter_name': 'stiffness',
+                       'parameter_search_width': 8200*0.5}
+
+
+@pytest.fixture(scope='session')
+def daslip_limit_cycle():
+    '''
+    x0 and p of DASLIP with the open-loop force of a limit cycle, as in
+    demos/computeQ_daslip.py. Copy p and x0 before modifying them.
+    '''
+    p = {'mass': 80, 'stiffness': 8200, 'resting_length': 0.9,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0.1, 'actuator_force': [],
+         'actuator_force_period': 10, 'activation_delay': 0.0,
+         'activation_amplification': 1.0,
+         'constant_normalized_damping': 0.75,
+         'linear_normalized_damping': 3.5,
+         'linear_minimum_normalized_damping': 0.05,
+         'swing_velocity': 0, 'angle_of_attack_offset': 0,
+         'swing_extension_velocity': 0, 'swing_leg_length_offset': 0}
+    x0 = np.array([0, 1.00, 5.5, 0, 0, 0, p['actuator_resting_length'],
+                   0, 0, 0])
+    x0 = daslip.reset_leg(x0, p)
+    p['total_energy'] = daslip.compute_total_energy(x0, p)
+    return daslip.create_open_loop_trajectories(x0, p, LIMIT_CYCLE_OPTIONS)
+
+
+@pytest.fixture(scope='session')
+def parslip_limit_cycle():
+    '''
+    Same as daslip_limit_cycle, for PARSLIP
+    '''
+    p = {'mass': 80, 'stiffness': 8200, 'resting_length': 0.9,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0.1, 'actuator_force': [],
+         'actuator_force_period': 10, 'activation_delay': 0.0,
+         'activation_amplification': 1.0, 'damping': 0.1}
+    x0 = parslip.reset_leg(np.array([0, 1.00, 5.5, 0, 0, 0, 0.]), p)
+    p['total_energy'] = parslip.compute_total_energy(x0, p)
+    return parslip.create_open_loop_trajectories(x0, p, LIMIT_CYCLE_OPTIONS)
+
+
+def setup_timedaoa(model, x0, p, profile='fast'):
+    '''
+    Poincare map of model with the (height, velocity) state and timed
+    activation of sa2xp_y_xdot_timedaoa, and a small grid around the limit
+    cycle. The coarse 'fast' profile keeps the tests quick.
+    '''
+    p = dict(p, x0=x0.copy(), integration_profile=profile)
+    p_map = model.poincare_map
+    p_map.p = p
+    p_map.x = x0.copy()
+    p_map.sa2xp = model.sa2xp_y_xdot_timedaoa
+    p_map.xp2s = model.xp2s_y_xdot
+    grids = {'states': (np.linspace(0.7, 1.3, 7), np.linspace(4, 7, 7)),
+             'actions': (np.linspace(28/180*np.pi, 44/180*np.pi, 4), )}
+    return p_map, grids
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import viability as vibly
+from models import daslip, parslip, slip
+
+from conftest import setup_timedaoa
+
+
+def test_lookup_matches_interp(daslip_limit_cycle):
+    _, p = daslip_limit_cycle
+    force = p['actuator_force']
+    t = np.linspace(0, 2*p['actuator_force_period'], 1001)
+    # a 1-element delay, as set by sa2xp_y_xdot_timedaoa
+    q = dict(p, activation_delay=np.array([0.013]),
+             activation_amplification=1.1)
+    expected = np.interp(t, force[0, :] + 0.013, force[1, :],
+                         period=p['actuator_force_period'])*1.1
+    assert np.array_equal(slip.actuator_force_lookup(q)(t), expected)
+
+
+@pytest.mark.parametrize('model', [daslip, parslip])
+def test_timedaoa_Q_map(request, model):
+    x0, p = request.getfixturevalue(model.__name__.split('.')[-1]
+                                    + '_limit_cycle')
+    p_map, grids = setup_timedaoa(model, x0, p)
+    Q_map, Q_F = vibly.compute_Q_map(grids, p_map)
+    assert Q_map.shape == (7, 7, 4)
+    assert not Q_F.all()
+    assert np.all(Q_map[~Q_F] > 0)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import viability as vibly
+from models import slip
+
+
+@pytest.fixture
+def slip_p_map():
+    p = {'mass': 80.0, 'stiffness': 8200.0, 'resting_length': 1.0,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0}
+    x0 = slip.reset_leg(np.array([0, 0.85, 5.5, 0, 0, 0, 0]), p)
+    p['x0'] = x0
+    p['total_energy'] = slip.compute_total_energy(x0, p)
+    p_map = slip.p_map
+    p_map.p = p
+    p_map.x = x0
+    p_map.sa2xp = slip.sa2xp
+    p_map.xp2s = slip.xp2s
+    return p_map
+
+
+def slip_grids(n):
+    return {'states': (np.linspace(0.1, 1, n), ),
+            'actions': (np.linspace(-10/180*np.pi, 70/180*np.pi, n), )}
+
+
+@pytest.mark.parametrize('levels', [0, 2, 3])
+def test_adaptive_matches_compute_QV(slip_p_map, levels):
+    # with levels=3, the coarsest 5x5 grid has no viable points
+    grids = slip_grids(41)
+    Q_map, Q_F = vibly.compute_Q_map(grids, slip_p_map, batch=True)
+    Q_V, S_V = vibly.compute_QV(Q_map, grids)
+    assert S_V.any()
+    Q_Va, S_Va, S_Ma, simulated = vibly.compute_QV_adaptive(
+        grids, slip_p_map, levels=levels, batch=True)
+    assert np.array_equal(Q_Va, Q_V)
+    assert np.array_equal(S_Va, S_V)
+    assert np.allclose(S_Ma, vibly.project_Q2S(Q_V, grids, proj_opt=np.mean))
+    if levels > 0:
+        assert not simulated.all()
@@ -0,0 +1,24 @@
+import numpy as np
+
+import viability as vibly
+from models import spaceship4
+
+
+def test_spaceship4_batch_matches_scalar():
+    p = {'n_states': 2, 'base_gravity': 0.2, 'gravity': .8,
+         'thrust_vertical': 0, 'thrust_horizontal': 0, 'ceiling': 2.1,
+         'wind': 0.5, 'control_frequency': 1.75, 'x0_upper_bound': 2,
+         'x0_lower_bound': 0, 'x1_upper_bound': 0.9, 'x1_lower_bound': -0.9}
+    p_map = spaceship4.p_map
+    p_map.p = p
+    p_map.x = np.array([1.0, 0.0])
+    p_map.sa2xp = spaceship4.sa2xp
+    p_map.xp2s = spaceship4.xp2s
+    # a coarser version of the grid of demos/computeQ_spaceship4.py
+    grids = {'states': (np.linspace(0, p['ceiling'], 11),
+                        np.linspace(-1, 1, 9)),
+             'actions': (np.linspace(0.0, 1, 6), np.linspace(-0.1, 0.1, 5))}
+    expected = vibly.compute_Q_map(grids, p_map, check_grid=True)
+    result = vibly.compute_Q_map(grids, p_map, check_grid=True, batch=True)
+    for val, ref in zip(result, expected):
+        assert np.array_equal(val, ref)
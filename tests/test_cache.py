@@ -0,0 +1,82 @@
+import inspect
+import os
+
+import numpy as np
+import pytest
+
+import viability as vibly
+from models import daslip, slip
+from viability.cache import _function_token
+
+from conftest import setup_timedaoa
+
+
+@pytest.fixture
+def slip_setup():
+    p = {'mass': 80.0, 'stiffness': 8200.0, 'resting_length': 1.0,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0}
+    x0 = slip.reset_leg(np.array([0, 0.85, 5.5, 0, 0, 0, 0]), p)
+    p['x0'] = x0
+    p['total_energy'] = slip.compute_total_energy(x0, p)
+    p_map = slip.p_map
+    p_map.p = p
+    p_map.x = x0
+    p_map.sa2xp = slip.sa2xp
+    p_map.xp2s = slip.xp2s
+    grids = {'states': (np.linspace(0.1, 1, 5)[:-1],),
+             'actions': (np.linspace(-10/180*np.pi, 70/180*np.pi, 5),)}
+    yield grids, p_map
+    if hasattr(p_map, 'integration_profile'):
+        del p_map.integration_profile
+
+
+def test_profile_changes_key(tmp_path, slip_setup):
+    grids, p_map = slip_setup
+    for cache in (vibly.QMapCache(str(tmp_path)),
+                  vibly.QMapCache(str(tmp_path), keys=('stiffness', ))):
+        keys = set()
+        for profile in ('fast', 'precise'):
+            p_map.integration_profile = profile
+            keys.add(cache.key(grids, p_map))
+        assert len(keys) == 2
+
+
+def test_profile_change_misses_cache(tmp_path, slip_setup):
+    grids, p_map = slip_setup
+    cache = vibly.QMapCache(str(tmp_path))
+    p_map.integration_profile = 'fast'
+    cache.compute_Q_map(grids, p_map)
+    p_map.integration_profile = 'precise'
+    Q_map, Q_F = cache.compute_Q_map(grids, p_map)
+    assert len([name for name in os.listdir(str(tmp_path))
+                if name.endswith('.npz')]) == 2
+    expected = vibly.compute_Q_map(grids, p_map)
+    assert np.array_equal(Q_map, expected[0])
+    assert np.array_equal(Q_F, expected[1])
+
+
+def test_profile_reaches_workers(slip_setup):
+    grids, p_map = slip_setup
+    p_map.integration_profile = 'precise'
+    assert vibly.model_parameters(p_map)['integration_profile'] == 'precise'
+    # an entry of p takes precedence
+    p_map.p = dict(p_map.p, integration_profile='fast')
+    assert vibly.model_parameters(p_map)['integration_profile'] == 'fast'
+
+
+def test_repeated_call_hits_cache(tmp_path, daslip_limit_cycle):
+    # daslip's sa2xp writes to p['x0'] while computing
+    p_map, grids = setup_timedaoa(daslip, *daslip_limit_cycle)
+    grids['states'] = tuple(grid[::2] for grid in grids['states'])
+    cache = vibly.QMapCache(str(tmp_path))
+    key = cache.key(grids, p_map)
+    Q_map, Q_F = cache.compute_Q_map(grids, p_map)
+    assert cache.key(grids, p_map) == key
+    assert os.listdir(str(tmp_path)) == [key + '.npz']
+    assert np.array_equal(cache.compute_Q_map(grids, p_map)[0], Q_map)
+
+
+def test_token_includes_used_modules():
+    _, sources = _function_token(daslip.poincare_map)
+    assert ('models.slip', inspect.getsource(slip)) in sources
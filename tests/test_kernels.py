@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from models import daslip, nslip, parslip, slip
+
+# max. |dx| of the final state between the kernels (fixed-step RK4) and the
+# step functions (solve_ivp, 'default' profile): positions and velocities,
+# and for DASLIP the work of actuator and damper (in J), which agree less
+# closely
+TOLERANCES = {'slip': 1e-7, 'nslip': 5e-4, 'daslip': 1e-5, 'parslip': 5e-5}
+WORK_TOLERANCE = 5e-3
+
+
+def slip_setup():
+    p = {'mass': 80.0, 'stiffness': 8200.0, 'resting_length': 1.0,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0}
+    x0 = slip.reset_leg(np.array([0, 0.85, 5.5, 0, 0, 0, 0]), p)
+    return x0, p, (10/180*np.pi, 50/180*np.pi), (0.6, 1.2)
+
+
+def nslip_setup():
+    p = {'mass': 80.0, 'stiffness': 705.0, 'resting_angle': 17/18*np.pi,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi, 'upper_leg': 0.5,
+         'lower_leg': 0.5}
+    x0 = nslip.reset_leg(np.array([0, 0.85, 5.5, 0, 0, 0, 0]), p)
+    p['total_energy'] = nslip.compute_total_energy(x0, p)
+    return x0, p, (10/180*np.pi, 50/180*np.pi), (0.6, 1.2)
+
+
+@pytest.fixture
+def model_setup(request):
+    name = request.param
+    if name == 'slip':
+        return slip, slip_setup()
+    if name == 'nslip':
+        return nslip, nslip_setup()
+    x0, p = request.getfixturevalue(name + '_limit_cycle')
+    aoa = p['angle_of_attack']
+    return {'daslip': daslip, 'parslip': parslip}[name], (
+        x0, p, (aoa - 0.1, aoa + 0.1), (0.9, 1.1))
+
+
+@pytest.mark.parametrize('model_setup', list(TOLERANCES),
+                         indirect=True)
+def test_kernels_match_step(model_setup):
+    model, (x0, p, aoa_range, height_range) = model_setup
+    name = model.__name__.split('.')[-1]
+    rng = np.random.default_rng(0)
+    samples = [(rng.uniform(*height_range), rng.uniform(*aoa_range))
+               for _ in range(8)]
+    # flat and steep angles of attack, which fail
+    samples += [(height_range[0], 0.05), (height_range[1], 1.45)]
+
+    failures = 0
+    for height, aoa in samples:
+        q = dict(p, angle_of_attack=aoa)
+        x = x0.copy()
+        x[1] = height
+        x = model.reset_leg(x, q)
+        x_step = model.step(x.copy(), q, final_only=True).y[:, -1]
+        x_kernel = slip.kernel_step(x.copy(), q, model.kernel_params)
+        failed = model.check_failure(x_step)
+        assert model.check_failure(x_kernel) == failed
+        failures += failed
+        if failed:
+            continue
+        error = np.abs(x_step - x_kernel)
+        if model is daslip:
+            assert np.max(error[7:9]) < WORK_TOLERANCE
+            error = np.delete(error, [7, 8])
+        assert np.max(error) < TOLERANCES[name]
+    assert 0 < failures < len(samples)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from models import slip
+
+
+@pytest.fixture
+def parameter_sets():
+    p = {'mass': 80.0, 'stiffness': 8200.0, 'resting_length': 1.0,
+         'gravity': 9.81, 'angle_of_attack': 1/5*np.pi,
+         'actuator_resting_length': 0}
+    rng = np.random.default_rng(1)
+    ps = []
+    xs = []
+    for _ in range(20):
+        p0 = dict(p, stiffness=p['stiffness']*rng.uniform(0.8, 1.2),
+                  angle_of_attack=p['angle_of_attack'] + rng.normal(0, 0.05))
+        xs.append(slip.reset_leg(
+            np.array([0, rng.uniform(0.6, 1.1), 5.5, 0, 0, 0, 0]), p0))
+        ps.append(p0)
+    xs[3][5] = -1.  # foot underground
+    return ps, np.column_stack(xs)
+
+
+@pytest.mark.parametrize('profile, tol', [(None, 1e-8), ('precise', 1e-8),
+                                          ('fast', 1e-3)])
+def test_tuple_matches_scalar(parameter_sets, profile, tol):
+    ps, X = parameter_sets
+    if profile is not None:
+        ps = [dict(p0, integration_profile=profile) for p0 in ps]
+    X_next, failed = slip.p_map(X, tuple(ps))
+    expected = [slip.p_map(X[:, idx].copy(), p0) for idx, p0 in enumerate(ps)]
+    assert np.array_equal(failed, [f for _, f in expected])
+    assert failed[3]
+    X_expected = np.column_stack([x for x, _ in expected])
+    assert np.allclose(X_next[:, ~failed], X_expected[:, ~failed], rtol=0,
+                       atol=tol)
+
+
+def test_tuple_uses_profile(parameter_sets):
+    ps, X = parameter_sets
+    default, _ = slip.p_map(X, tuple(ps))
+    fast, _ = slip.p_map(X, tuple(dict(p0, integration_profile='fast')
+                                  for p0 in ps))
+    assert not np.array_equal(default, fast)
+
+
+def test_tuple_mixed_profiles(parameter_sets):
+    ps, X = parameter_sets
+    ps = [dict(p0, integration_profile='fast') for p0 in ps]
+    ps[0]['integration_profile'] = 'precise'
+    with pytest.raises(ValueError):
+        slip.p_map(X, tuple(ps))
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+import viability as vibly
+from models import daslip
+from viability.sweep import sweep_filename
+
+from conftest import setup_timedaoa
+
+VALUES = (1.5, 0.0, 0.5)
+
+
+@pytest.fixture(scope='module')
+def expected(daslip_limit_cycle):
+    x0, p = daslip_limit_cycle
+    results = []
+    for value in VALUES:
+        p_map, grids = setup_timedaoa(
+            daslip, x0, dict(p, constant_normalized_damping=value))
+        Q_map, Q_F = vibly.compute_Q_map(grids, p_map)
+        Q_V, S_V = vibly.compute_QV(Q_map, grids)
+        S_M = vibly.project_Q2S(Q_V, grids, proj_opt=np.mean)
+        results.append({'Q_map': Q_map, 'Q_F': Q_F, 'Q_V': Q_V, 'S_V': S_V,
+                        'S_M': S_M})
+    return results
+
+
+# on this grid, the viable set shrinks with damping
+@pytest.mark.parametrize('monotone', [None, 'decreasing'])
+def test_sweep_matches_compute_Q_map(tmp_path, daslip_limit_cycle, expected,
+                                     monotone):
+    x0, p = daslip_limit_cycle
+    p_map, grids = setup_timedaoa(daslip, x0, p)
+    results = vibly.sweep(grids, p_map, 'constant_normalized_damping',
+                          VALUES, path=str(tmp_path), processes=1,
+                          monotone=monotone)
+    assert any(result['Q_V'].any() for result in results)
+    for value, result, reference in zip(VALUES, results, expected):
+        assert result['p']['constant_normalized_damping'] == value
+        for name, val in reference.items():
+            assert np.array_equal(result[name], val), name
+        assert os.path.exists(sweep_filename(str(tmp_path), 'sweep', value))
+
+    # saved results are loaded instead of computed again
+    loaded = vibly.sweep(grids, p_map, 'constant_normalized_damping',
+                         VALUES, path=str(tmp_path), processes=1)
+    for result, reference in zip(loaded, expected):
+        assert np.array_equal(result['Q_V'], reference['Q_V'])
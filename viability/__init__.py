@@ -1,11 +1,29 @@
 # https://towardsdatascience.com/whats-init-for-me-d70a312da583
 
 from .viability import compute_Q_map
+from .viability import refine_Q_map
+from .viability import compute_Q_map_multi
+from .viability import rebin
 from .viability import project_Q2S
 from .viability import compute_QV
+from .viability import compute_QV_graph
+from .viability import compute_QV_vectorized
+from .viability import compute_QV_stacked
 from .viability import map_S2Q
 from .viability import get_feasibility_mask
 from .viability import get_grid_indices
 from .viability import is_outside
 from .viability import parcompute_Q_map
 from .viability import digitize_s
+from .viability import digitize_s_batch
+from .viability import get_corner_table
+from .viability import get_state_actions
+from .viability import model_parameters
+from .cache import QMapCache
+from .adaptive import compute_QV_adaptive
+from .lazy import compute_QV_lazy
+from .lazy import TransitionOracle
+from .sweep import sweep
+from .workqueue import queue_compute_Q_map
+from .workqueue import run_worker
+from .workqueue import merge_Q_map
@@ -0,0 +1,21 @@
+'''
+Worker of a file-based work queue (see `workqueue`), run with
+python -m viability <folder> [--poll seconds] [--stale-timeout seconds]
+'''
+
+import argparse
+
+from .workqueue import STALE_TIMEOUT, run_worker
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compute tasks of a transition map work queue.')
+    parser.add_argument('path', help='folder of the queue')
+    parser.add_argument('--poll', type=float, default=1.0,
+                        help='seconds between looking for new tasks')
+    parser.add_argument('--stale-timeout', type=float, default=STALE_TIMEOUT,
+                        help='seconds after which claimed tasks of other'
+                        ' workers are requeued')
+    parser.add_argument('--verbose', type=int, default=0)
+    args = parser.parse_args()
+    run_worker(args.path, args.poll, args.stale_timeout, args.verbose)
@@ -0,0 +1,169 @@
+'''
+Adaptive coarse-to-fine computation of the viable set: the transition map is
+first computed on a coarse sub-grid, and then only refined in cells which
+straddle the boundary of the viable set, instead of simulating the whole fine
+grid.
+'''
+
+import itertools as it
+
+import numpy as np
+
+from .viability import (allocate_Q_map, compute_QV_vectorized,
+                        get_state_actions, iterate_chunks, project_Q2S,
+                        simulate_state_actions, store_transitions)
+
+
+def _sub_grids(grids, stride):
+    return {'states': tuple(np.asarray(grid)[::stride]
+                            for grid in grids['states']),
+            'actions': tuple(np.asarray(grid)[::stride]
+                             for grid in grids['actions'])}
+
+
+def _upsample(Q_V):
+    '''
+    Interpolate a boolean array on a grid to the grid with twice the
+    resolution (2n-1 points per dimension). Each new point looks at the
+    (up to 2**n) points of the coarse cell it lies in.
+    returns the value of all corners where they agree, and where they do not
+    '''
+    lows = [np.arange(2*size - 1)//2 for size in Q_V.shape]
+    highs = [(np.arange(2*size - 1) + 1)//2 for size in Q_V.shape]
+    all_true = np.ones(tuple(2*size - 1 for size in Q_V.shape), dtype=bool)
+    any_true = np.zeros_like(all_true)
+    for corner in it.product((0, 1), repeat=Q_V.ndim):
+        val = Q_V[np.ix_(*[high if bit else low for bit, low, high
+                           in zip(corner, lows, highs)])]
+        all_true &= val
+        any_true |= val
+    return all_true, any_true & ~all_true
+
+
+def _dilate(mask, width):
+    '''
+    Grow a boolean array by width points in each direction (including
+    diagonals)
+    '''
+    mask = mask.copy()
+    for axis in range(mask.ndim):
+        for _ in range(width):
+            grown = mask.copy()
+            lower = [slice(None)]*mask.ndim
+            upper = [slice(None)]*mask.ndim
+            lower[axis] = slice(None, -1)
+            upper[axis] = slice(1, None)
+            grown[tuple(lower)] |= mask[tuple(upper)]
+            grown[tuple(upper)] |= mask[tuple(lower)]
+            mask = grown
+    return mask
+
+
+def compute_QV_adaptive(grids, p_map, levels=3, margin=1, check_grid=False,
+                        batch=False, verbose=0):
+    '''
+    Compute the viable set on the (fine) grids, without simulating all of it.
+    The transition map is first computed on the sub-grid with every
+    2**levels-th point. At each level, the resolution is then doubled, and
+    only the new points in cells which straddle the boundary of the viable set
+    (in state-action space) are simulated. All other new points are assigned
+    the value of their cell, and kept fixed (see `Q_pinned` in
+    `compute_QV_vectorized`). If a level has no such cells, e.g. if the
+    coarsest grid has no viable points at all, all points of the next level
+    are simulated.
+    NOTE: cells which are entirely viable (or not) at a coarse resolution are
+    assumed to stay so, i.e. features of the viable set smaller than a coarse
+    cell can be missed. This can both under- and overestimate the viable set,
+    since points pinned as viable are never simulated. Compare with
+    `compute_QV` on a few grids before relying on it.
+    - grids: fine grids, each with k*2**levels + 1 points, for some k
+    - margin: also refine this many cells around each straddling cell
+    - check_grid, batch: see `compute_Q_map`
+    returns
+    Q_V, S_V: viable set and viability kernel on the fine grids
+    S_M: measure of each state, np.mean of Q_V over the actions
+    simulated: boolean array marking the simulated state-action pairs
+    '''
+    stride = 2**levels
+    sa_grids = tuple(grids['states']) + tuple(grids['actions'])
+    sa_shape = tuple(map(np.size, sa_grids))
+    for grid in sa_grids:
+        if (np.size(grid) - 1) % stride != 0:
+            raise ValueError('grids need k*2**levels + 1 points, got '
+                             + str(np.size(grid)) + ' for levels='
+                             + str(levels))
+    n_states = len(grids['states'])
+
+    # landing states of all simulated points, sorted by flat (fine) index
+    sim_idx = np.zeros(0, dtype=int)
+    sim_S = np.zeros((0, n_states))
+    sim_F = np.zeros(0, dtype=bool)
+    simulated = np.zeros(sa_shape, dtype=bool)
+
+    Q_V = None
+    while stride >= 1:
+        level = tuple(slice(None, None, stride) for _ in sa_shape)
+        level_grids = _sub_grids(grids, stride)
+        level_shape = tuple(map(np.size, tuple(level_grids['states'])
+                                + tuple(level_grids['actions'])))
+
+        # * pick the new points to simulate
+        if Q_V is None:  # coarsest level: all of them
+            pinned_value = np.zeros(level_shape, dtype=bool)
+            new = np.ones(level_shape, dtype=bool)
+        else:
+            pinned_value, mixed = _upsample(Q_V)
+            if mixed.any():
+                # each coarse cell spans 2 points of this level
+                new = _dilate(mixed, 2*margin) & ~simulated[level]
+            else:  # no boundary to refine around, simulate the whole level
+                pinned_value[:] = False
+                new = ~simulated[level]
+        new_idx = np.ravel_multi_index(
+            tuple(idx*stride for idx in np.nonzero(new)), sa_shape)
+
+        # * simulate them
+        S_new = np.zeros((new_idx.size, n_states))
+        F_new = np.zeros(new_idx.size, dtype=bool)
+        for start, stop in iterate_chunks(new_idx.size):
+            S_new[start:stop], F_new[start:stop] = simulate_state_actions(
+                get_state_actions(grids, indices=new_idx[start:stop]),
+                n_states, p_map, p_map.p, p_map.sa2xp, p_map.xp2s, batch)
+        simulated.reshape(-1)[new_idx] = True
+        order = np.argsort(np.concatenate((sim_idx, new_idx)))
+        sim_idx = np.concatenate((sim_idx, new_idx))[order]
+        sim_S = np.concatenate((sim_S, S_new))[order]
+        sim_F = np.concatenate((sim_F, F_new))[order]
+        if verbose > 0:
+            print('stride ' + str(stride) + ': simulated '
+                  + str(new_idx.size) + ' of '
+                  + str(int(np.prod(level_shape))) + ' points.')
+
+        # * bin all simulated points of this level on its grid
+        level_sim = simulated[level]
+        level_idx = np.flatnonzero(level_sim)
+        pos = np.searchsorted(sim_idx, np.ravel_multi_index(
+            tuple(idx*stride for idx in np.unravel_index(level_idx,
+                                                         level_shape)),
+            sa_shape))
+        out = allocate_Q_map(level_grids, check_grid,
+                             total_gridpoints=level_idx.size)
+        store_transitions(out, 0, level_idx.size, sim_S[pos], sim_F[pos],
+                          level_grids, check_grid)
+        Q_map = np.zeros(level_shape, dtype=int)
+        Q_map.reshape(-1)[level_idx] = out['Q_map']
+        Q_V = pinned_value.copy()
+        # same start as compute_QV
+        Q_V.reshape(-1)[level_idx] = out['Q_map'].astype(bool)
+        Q_on_grid = None
+        if check_grid:
+            Q_on_grid = np.zeros(level_shape, dtype=bool)
+            Q_on_grid.reshape(-1)[level_idx] = out['Q_on_grid']
+
+        Q_V, S_V = compute_QV_vectorized(Q_map, level_grids, Q_V=Q_V,
+                                         Q_on_grid=Q_on_grid,
+                                         Q_pinned=~level_sim)
+        stride //= 2
+
+    S_M = project_Q2S(Q_V, grids, proj_opt=np.mean)
+    return Q_V, S_V, S_M, simulated
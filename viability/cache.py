@@ -0,0 +1,206 @@
+'''
+On-disk cache of transition maps, so that repeated calls to `compute_Q_map`
+or `parcompute_Q_map` with unchanged inputs do not resimulate the grid.
+'''
+
+import copy
+import hashlib
+import inspect
+import os
+
+import numpy as np
+
+from .viability import compute_Q_map, model_parameters, parcompute_Q_map
+
+
+def _module_sources(module):
+    '''
+    Source code of module, and of the modules of the same package it uses,
+    recursively (e.g. models.slip for models.daslip)
+    returns a list of (module name, source) pairs, sorted by name
+    '''
+    package = module.__name__.split('.')[0]
+    sources = {module.__name__: inspect.getsource(module)}
+    todo = [module]
+    while todo:
+        for val in vars(todo.pop()).values():
+            used = val if inspect.ismodule(val) else inspect.getmodule(val)
+            if (used is None or used.__name__ in sources
+                    or used.__name__.split('.')[0] != package):
+                continue
+            try:
+                sources[used.__name__] = inspect.getsource(used)
+            except (TypeError, OSError):  # e.g. compiled extensions
+                sources[used.__name__] = None
+            todo.append(used)
+    return sorted(sources.items())
+
+
+def _function_token(f):
+    '''
+    Identify a function by its name and the source code of its module, and
+    of the modules of the same package it uses, so that editing the model
+    (e.g. the step function called by p_map, or the helpers of models/slip.py
+    used by daslip) invalidates cached results.
+    NOTE: modules of other packages (e.g. scipy) are not part of the hash.
+    '''
+    name = (getattr(f, '__module__', None), getattr(f, '__qualname__', None))
+    try:
+        source = _module_sources(inspect.getmodule(f))
+    except (TypeError, OSError, AttributeError):
+        code = getattr(f, '__code__', None)
+        source = code.co_code if code is not None else repr(f)
+    return name, source
+
+
+def _update_hash(h, obj):
+    '''
+    Feed a (nested) structure of dicts, lists, arrays and scalars to the hash
+    h, independently of dict ordering.
+    '''
+    if isinstance(obj, dict):
+        h.update(b'dict')
+        for key in sorted(obj, key=repr):
+            _update_hash(h, key)
+            _update_hash(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'list' + str(len(obj)).encode())
+        for val in obj:
+            _update_hash(h, val)
+    elif isinstance(obj, np.ndarray):
+        h.update(b'array' + obj.dtype.str.encode() + str(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif callable(obj):
+        _update_hash(h, _function_token(obj))
+    elif isinstance(obj, bytes):
+        h.update(obj)
+    else:
+        h.update(repr(obj).encode())
+
+
+class QMapCache:
+    '''
+    Cache of transition maps in the folder `path`. Each result is stored in a
+    .npz file named by a hash of the model (p_map, sa2xp and xp2s), the
+    parameters, the grids and the options of compute_Q_map.
+    - max_size: maximum total size in bytes. When exceeded, the least
+    recently used results are deleted.
+    - keys: if given, only these entries of the parameter dict are part of
+    the hash. Use this if p contains entries which do not affect the map.
+    '''
+
+    def __init__(self, path, max_size=2**30, keys=None):
+        self.path = path
+        self.max_size = max_size
+        self.keys = keys
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, grids, p_map, check_grid=False, keep_coords=False,
+            batch=False):
+        '''
+        Hash identifying a transition map
+        '''
+        p = model_parameters(p_map)
+        if self.keys is not None:
+            # the integration profile always affects the map
+            p = {key: p[key] for key in list(self.keys)
+                 + ['integration_profile'] if key in p}
+        h = hashlib.sha256()
+        _update_hash(h, [[p_map, p_map.sa2xp, p_map.xp2s], p, grids,
+                         check_grid, keep_coords, batch])
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def load(self, key):
+        '''
+        Return the cached list of arrays for key, or None if not cached.
+        '''
+        filename = self._file(key)
+        try:
+            with np.load(filename) as data:
+                result = [data['arr_' + str(idx)]
+                          for idx in range(len(data.files))]
+        except FileNotFoundError:
+            return None
+        os.utime(filename)  # mark as recently used
+        return result
+
+    def save(self, key, result):
+        '''
+        Store the list of arrays `result` under key, then evict old results
+        if the cache is too large.
+        '''
+        filename = self._file(key)
+        tmp_file = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_file, 'wb') as outfile:
+            np.savez(outfile, *result)
+        os.replace(tmp_file, filename)  # never leave a partial file behind
+        self._evict(keep=filename)
+
+    def _evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size,
+                                os.path.join(self.path, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            if filename == keep:
+                continue
+            os.remove(filename)
+            total -= size
+
+    def compute_Q_map(self, grids, p_map, verbose=0, check_grid=False,
+                      keep_coords=False, batch=False, parallel=False,
+                      **kwargs):
+        '''
+        Same as compute_Q_map (or parcompute_Q_map, if parallel), but the
+        result is loaded from the cache if available, and stored otherwise.
+        Other keyword arguments are passed on, and do not affect the hash.
+        '''
+        key = self.key(grids, p_map, check_grid, keep_coords, batch)
+        result = self.load(key)
+        if result is not None:
+            if verbose > 0:
+                print('loaded transition map ' + key[:8] + ' from cache.')
+            return result
+        compute = parcompute_Q_map if parallel else compute_Q_map
+        # compute with a copy of the parameters: sa2xp of some models (e.g.
+        # daslip) write to p['x0'], which would change the key of the next
+        # call
+        p = p_map.p
+        p_map.p = copy.deepcopy(p)
+        try:
+            result = compute(grids, p_map, verbose=verbose,
+                             check_grid=check_grid, keep_coords=keep_coords,
+                             batch=batch, **kwargs)
+        finally:
+            p_map.p = p
+        self.save(key, result)
+        return result
+
+    def invalidate(self, grids, p_map, check_grid=False, keep_coords=False,
+                   batch=False):
+        '''
+        Remove a single transition map from the cache.
+        Returns True if there was something to remove.
+        '''
+        try:
+            os.remove(self._file(self.key(grids, p_map, check_grid,
+                                          keep_coords, batch)))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def clear(self):
+        '''
+        Remove all cached transition maps.
+        '''
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.path, name))
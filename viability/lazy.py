@@ -0,0 +1,178 @@
+'''
+Lazy computation of the viable set: instead of computing the whole transition
+map up front, state-action pairs are only simulated when the viability
+computation needs them.
+'''
+
+import collections
+
+import numpy as np
+
+from .viability import (BATCH_CHUNK_SIZE, allocate_Q_map, deliver_Q_map,
+                        get_corner_table, get_state_actions, iterate_chunks,
+                        simulate_state_actions, store_transitions)
+
+
+class TransitionOracle:
+    '''
+    Memoized transition map on the grids: each state-action pair is only
+    simulated the first time it is requested.
+    - check_grid, batch: see `compute_Q_map`
+    '''
+
+    def __init__(self, grids, p_map, check_grid=False, batch=False):
+        self.grids = grids
+        self.p_map = p_map
+        self.check_grid = check_grid
+        self.batch = batch
+        self.out = allocate_Q_map(grids, check_grid)
+        self.evaluated = np.zeros(self.out['Q_map'].size, dtype=bool)
+        self.simulations = 0
+
+    def evaluate(self, indices):
+        '''
+        Simulate the state-action pairs with the given flat grid indices,
+        unless already done.
+        '''
+        indices = np.unique(np.asarray(indices, dtype=int))
+        new = indices[~self.evaluated[indices]]
+        n_states = len(self.grids['states'])
+        chunk_size = BATCH_CHUNK_SIZE if self.batch else None
+        for start, stop in iterate_chunks(new.size, chunk_size):
+            S_next, failed = simulate_state_actions(
+                get_state_actions(self.grids, indices=new[start:stop]),
+                n_states, self.p_map, self.p_map.p, self.p_map.sa2xp,
+                self.p_map.xp2s, self.batch)
+            out = allocate_Q_map(self.grids, self.check_grid,
+                                 total_gridpoints=stop - start)
+            store_transitions(out, 0, stop - start, S_next, failed,
+                              self.grids, self.check_grid)
+            for name, val in out.items():
+                self.out[name][new[start:stop]] = val
+        self.evaluated[new] = True
+        self.simulations += new.size
+
+    def corners(self, indices):
+        '''
+        Grid points enclosing the states reached from the given flat grid
+        indices (see `get_corner_table`), simulating them if needed.
+        Pairs which fail, or land outside the grid, have a row of -1.
+        '''
+        indices = np.asarray(indices, dtype=int)
+        self.evaluate(indices)
+        Q_map = self.out['Q_map'][indices]
+        Q_on_grid = None
+        if self.check_grid:
+            Q_on_grid = self.out['Q_on_grid'][indices]
+        corners = get_corner_table(Q_map, self.grids, Q_on_grid)
+        # as in compute_QV, bin 0 is never viable
+        corners[Q_map == 0] = -1
+        return corners
+
+    def deliver(self):
+        '''
+        The transition map computed so far, as returned by `compute_Q_map`.
+        Only entries marked in `evaluated` are meaningful.
+        '''
+        return deliver_Q_map(self.out, self.grids)
+
+
+def compute_QV_lazy(grids, p_map, check_grid=False, batch=False,
+                    block_size=None, oracle=None, verbose=0):
+    '''
+    Compute the viability kernel, simulating state-action pairs only when
+    needed. Each state keeps one viable action as a witness, found by trying
+    actions close to the witness of the previous state first. When a state
+    runs out of viable actions, it is removed from S_V, and only the states
+    whose witnesses land next to it are checked again. Actions of states
+    already removed are never simulated, neither are the remaining actions of
+    viable states once a witness is found.
+    NOTE: Q_V only contains the viable pairs that were simulated (at least one
+    per viable state). To compute measures, the full viable set is needed,
+    see `compute_Q_map`.
+    - check_grid, batch: see `compute_Q_map`
+    - block_size: number of actions of a state first simulated at once while
+    searching for a witness, doubled for each further block. Defaults to 1,
+    or 8 with batch.
+    - oracle: a `TransitionOracle`, e.g. to reuse its simulations
+    returns
+    Q_V, S_V: same as `compute_QV`, see the note for Q_V
+    oracle: the `TransitionOracle`, with the transitions simulated so far
+    '''
+    if oracle is None:
+        oracle = TransitionOracle(grids, p_map, check_grid, batch)
+    if block_size is None:
+        block_size = 8 if batch else 1
+    s_grid_shape = tuple(map(np.size, grids['states']))
+    a_grid_shape = tuple(map(np.size, grids['actions']))
+    n_states = int(np.prod(s_grid_shape))
+    n_actions = int(np.prod(a_grid_shape))
+    actions = np.arange(n_actions)
+
+    def viable(corners, S_V):
+        return (corners >= 0).all(axis=1) & S_V[corners].all(axis=1)
+
+    S_V = np.ones(n_states, dtype=bool)
+    witness = np.full(n_states, -1)
+    witness_corners = {}
+    # pairs known not to be viable. Since S_V only shrinks, they stay so.
+    rejected = np.zeros((n_states, n_actions), dtype=bool)
+    # for each grid point, states whose witness lands next to it
+    dependents = collections.defaultdict(set)
+
+    worklist = collections.deque(range(n_states))
+    queued = np.ones(n_states, dtype=bool)
+    hint = n_actions // 2
+    while worklist:
+        sdx = worklist.popleft()
+        queued[sdx] = False
+        if not S_V[sdx]:
+            continue
+        if witness[sdx] >= 0:
+            if S_V[witness_corners[sdx]].all():
+                continue
+            rejected[sdx, witness[sdx]] = True
+            hint = witness[sdx]
+
+        # * search for a new witness, closest to the hint first
+        order = np.argsort(np.abs(actions - hint), kind='stable')
+        candidates = order[~rejected[sdx, order]]
+        found = -1
+        start = 0
+        size = block_size
+        while found < 0 and start < candidates.size:
+            block = candidates[start:start + size]
+            start += size
+            size *= 2
+            corners = oracle.corners(sdx*n_actions + block)
+            ok = viable(corners, S_V)
+            rejected[sdx, block[~ok]] = True
+            if ok.any():
+                found = np.argmax(ok)
+                witness[sdx] = block[found]
+                witness_corners[sdx] = np.unique(corners[found])
+                for point in witness_corners[sdx]:
+                    dependents[point].add(sdx)
+                hint = witness[sdx]
+
+        if found < 0:  # no viable actions left
+            S_V[sdx] = False
+            for tdx in dependents.pop(sdx, ()):
+                if S_V[tdx] and not queued[tdx]:
+                    worklist.append(tdx)
+                    queued[tdx] = True
+
+    Q_V = np.zeros(n_states*n_actions, dtype=bool)
+    q_idx = np.flatnonzero(oracle.evaluated)
+    q_idx = q_idx[S_V[q_idx // n_actions]]
+    for start, stop in iterate_chunks(q_idx.size, BATCH_CHUNK_SIZE):
+        Q_V[q_idx[start:stop]] = viable(oracle.corners(q_idx[start:stop]),
+                                        S_V)
+
+    if verbose > 0:
+        print('simulated ' + str(oracle.simulations) + ' of '
+              + str(n_states*n_actions) + ' points, saved '
+              + str(n_states*n_actions - oracle.simulations) + '.')
+
+    return (Q_V.reshape(s_grid_shape + a_grid_shape),
+            S_V.reshape(s_grid_shape), oracle)
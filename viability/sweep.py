@@ -0,0 +1,220 @@
+'''
+Compute viable sets and measures of a model for a range of values of one
+parameter, e.g. the damping study, with one pool of workers for all of them.
+'''
+
+import os
+import pickle
+
+import numpy as np
+
+from .viability import (BATCH_CHUNK_SIZE, CHUNK_SIZE, _attach_outputs,
+                        _create_shared, allocate_Q_map, compute_QV_vectorized,
+                        deliver_Q_map, get_corner_table, get_state_actions,
+                        iterate_chunks, map_S2Q, model_parameters,
+                        project_Q2S, simulate_state_actions,
+                        store_transitions)
+
+# state of each worker process, set by the pool initializer
+_worker = {}
+
+
+def _init_sweep_worker(grids, p_map, p, sa2xp, xp2s, check_grid, batch, key,
+                       values, specs):
+    outs = []
+    blocks = []
+    for spec in specs:
+        out, block = _attach_outputs(spec)
+        outs.append(out)
+        blocks.append(block)
+    _worker.update(grids=grids, p_map=p_map, p=p, sa2xp=sa2xp, xp2s=xp2s,
+                   check_grid=check_grid, batch=batch, key=key,
+                   values=values, outs=outs, blocks=blocks)
+
+
+def _compute_sweep_chunk(task):
+    '''
+    Pool task: simulate and bin the flat grid indices [start, stop) for the
+    parameter value with index vdx
+    '''
+    vdx, start, stop = task
+    grids = _worker['grids']
+    p = dict(_worker['p'])
+    p[_worker['key']] = _worker['values'][vdx]
+    S_next, failed = simulate_state_actions(
+        get_state_actions(grids, start, stop), len(grids['states']),
+        _worker['p_map'], p, _worker['sa2xp'], _worker['xp2s'],
+        _worker['batch'])
+    store_transitions(_worker['outs'][vdx], start, stop, S_next, failed,
+                      grids, _worker['check_grid'])
+    return task
+
+
+def sweep_filename(path, name, value):
+    '''
+    File the result for one parameter value is saved to by `sweep`
+    '''
+    if isinstance(value, (int, float, np.number)):
+        value = '{:.4f}'.format(value)
+    return os.path.join(path, name + '_' + str(value) + '.pickle')
+
+
+def _warm_start(results, values, vdx, monotone):
+    '''
+    S_V of the closest finished value which is known to have a larger
+    viability kernel than values[vdx], or None
+    '''
+    best = None
+    for other, result in enumerate(results):
+        if result is None:
+            continue
+        larger = values[other] > values[vdx]
+        if larger != (monotone == 'increasing') or (
+                values[other] == values[vdx]):
+            continue
+        if best is None or (abs(values[other] - values[vdx])
+                            < abs(values[best] - values[vdx])):
+            best = other
+    return None if best is None else results[best]['S_V']
+
+
+def sweep(grids, p_map, key, values, path=None, name='sweep',
+          processes=None, chunk_size=None, check_grid=False, batch=False,
+          monotone=None, callback=None, verbose=0):
+    ''' Compute the viable set and measure for each value of the parameter
+    p_map.p[key]. The transition maps of all values are computed by one pool
+    of workers, which is kept busy throughout: tasks are (value, chunk of
+    the grid) pairs. As soon as the map of one value is complete, its viable
+    set and measure are computed (see `compute_QV_vectorized`) and saved.
+    - path: folder to save the result of each value in (see
+    `sweep_filename`), as a dict with the grids, Q_map, Q_F, (Q_on_grid),
+    Q_V, S_V, S_M, Q_M, p and x0 (p_map.x, if set). Values which are already
+    saved there are loaded instead of computed again.
+    - processes, chunk_size, check_grid, batch: see `parcompute_Q_map`
+    - monotone: 'increasing' (or 'decreasing') if the viability kernel is
+    known to grow (or shrink) with the value of the parameter. The viable set
+    of each value then starts from the pairs landing in the kernel of its
+    closest finished neighbour with a larger kernel, instead of from all
+    non-failing state-action pairs, and values are computed in order of
+    decreasing kernels. Only use this if it is known to hold, otherwise the
+    results are wrong.
+    - callback: called as callback(value, result) for each value, once its
+    result is saved
+    returns the list of results (as saved) for all values
+    '''
+
+    import multiprocessing as mp
+
+    if monotone not in (None, 'increasing', 'decreasing'):
+        raise ValueError('monotone has to be None, increasing or decreasing,'
+                         ' not ' + str(monotone))
+    if processes is None:
+        processes = mp.cpu_count()
+    values = list(values)
+    p = model_parameters(p_map).copy()
+    s_grid_shape = list(map(np.size, grids['states']))
+    a_grid_shape = list(map(np.size, grids['actions']))
+    total_gridpoints = int(np.prod(s_grid_shape)*np.prod(a_grid_shape))
+    if chunk_size is None:
+        chunk_size = int(np.clip(
+            len(values)*total_gridpoints // (8*processes), 1,
+            BATCH_CHUNK_SIZE if batch else CHUNK_SIZE))
+
+    results = [None]*len(values)
+
+    def finish(vdx, result):
+        results[vdx] = result
+        if callback is not None:
+            callback(values[vdx], result)
+
+    todo = []
+    for vdx, value in enumerate(values):
+        if path is not None and os.path.exists(sweep_filename(path, name,
+                                                               value)):
+            with open(sweep_filename(path, name, value), 'rb') as infile:
+                finish(vdx, pickle.load(infile))
+            if verbose > 0:
+                print(key + ' = ' + str(value) + ': loaded.')
+        else:
+            todo.append(vdx)
+    if monotone is not None:  # largest viable sets first
+        todo.sort(key=lambda vdx: values[vdx],
+                  reverse=(monotone == 'increasing'))
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+
+    blocks = [{} for _ in values]
+    try:
+        shared = [None]*len(values)
+        specs = [{} for _ in values]
+        for vdx in todo:
+            shared[vdx] = allocate_Q_map(
+                grids, check_grid,
+                zeros=lambda *args: _create_shared(blocks[vdx], *args))
+            specs[vdx] = {field: ('shm', blocks[vdx][field].name, val.shape,
+                                  val.dtype.str)
+                          for field, val in shared[vdx].items()}
+        tasks = [(vdx, start, stop) for vdx in todo
+                 for start, stop in iterate_chunks(total_gridpoints,
+                                                   chunk_size)]
+        remaining = {vdx: -(-total_gridpoints // chunk_size)
+                     for vdx in todo}
+        if verbose > 0:
+            print('computing ' + str(len(todo)) + ' values, a total of '
+                  + str(len(todo)*total_gridpoints) + ' points.')
+
+        initargs = (grids, p_map, p, p_map.sa2xp, p_map.xp2s, check_grid,
+                    batch, key, values, specs)
+        with mp.Pool(processes, initializer=_init_sweep_worker,
+                     initargs=initargs) as pool:
+            for vdx, _, _ in pool.imap(_compute_sweep_chunk, tasks):
+                remaining[vdx] -= 1
+                if remaining[vdx] > 0:
+                    continue
+
+                # * all chunks of this value are done
+                out = {field: np.array(val)
+                       for field, val in shared[vdx].items()}
+                deliver = deliver_Q_map(out, grids)
+                Q_map, Q_F = deliver[:2]
+                Q_on_grid = deliver[2] if check_grid else None
+                Q_V = None
+                S_V = None
+                if monotone is not None:
+                    S_V = _warm_start(results, values, vdx, monotone)
+                if S_V is not None:
+                    # pairs landing outside a larger kernel are not viable
+                    corners = get_corner_table(Q_map, grids, Q_on_grid)
+                    Q_V = Q_map.astype(bool).reshape(-1) & np.all(
+                        (corners >= 0) & S_V.reshape(-1)[corners], axis=1)
+                    Q_V = Q_V.reshape(Q_map.shape)
+                Q_V, S_V = compute_QV_vectorized(Q_map, grids, Q_V=Q_V,
+                                                 Q_on_grid=Q_on_grid)
+                S_M = project_Q2S(Q_V, grids, proj_opt=np.mean)
+                Q_M = map_S2Q(Q_map, S_M, grids['states'], Q_V=Q_V,
+                              Q_on_grid=Q_on_grid)
+                result = {'grids': grids, 'Q_map': Q_map, 'Q_F': Q_F,
+                          'Q_V': Q_V, 'S_V': S_V, 'S_M': S_M, 'Q_M': Q_M,
+                          'p': dict(p, **{key: values[vdx]}),
+                          'x0': getattr(p_map, 'x', None)}
+                if check_grid:
+                    result['Q_on_grid'] = Q_on_grid
+                if path is not None:
+                    # write to a temporary file first, so that an interrupted
+                    # save is not mistaken for a result when resuming
+                    filename = sweep_filename(path, name, values[vdx])
+                    with open(filename + '.tmp', 'wb') as outfile:
+                        pickle.dump(result, outfile)
+                    os.replace(filename + '.tmp', filename)
+                if verbose > 0:
+                    print(key + ' = ' + str(values[vdx]) + ': viable portion'
+                          ' of Q: ' + str(np.mean(Q_V)))
+                finish(vdx, result)
+    finally:
+        shared = None
+        for value_blocks in blocks:
+            for block in value_blocks.values():
+                block.close()
+                block.unlink()
+
+    return results
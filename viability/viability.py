@@ -145,83 +145,531 @@ def digitize_s(s, s_grid, shape=None, to_bin=True):
         return np.ravel_multi_index(s_idx, shape)
 
 
+def _uniform_step(grid):
+    '''
+    Return the step size if grid is increasing with uniform spacing (such as
+    made by np.linspace), None otherwise
+    '''
+    if grid.size < 2:
+        return None
+    step = (grid[-1] - grid[0])/(grid.size - 1)
+    if step > 0 and np.allclose(np.diff(grid), step, rtol=1e-9, atol=0):
+        return step
+    return None
+
+
+def _digitize_dim(s, grid):
+    '''
+    Same as np.digitize(s, grid), for an array s
+    '''
+    step = _uniform_step(grid)
+    if step is None:
+        return np.digitize(s, grid)
+
+    # compute the bin directly, then correct for round-off in both directions
+    bin_idx = np.clip(np.floor((s - grid[0])/step) + 1, 0, grid.size)
+    bin_idx[np.isnan(s)] = grid.size
+    bin_idx = bin_idx.astype(int)
+    below = (bin_idx > 0) & (s < grid[np.maximum(bin_idx - 1, 0)])
+    bin_idx[below] -= 1
+    above = (bin_idx < grid.size) & (s >= grid[np.minimum(bin_idx,
+                                                         grid.size - 1)])
+    bin_idx[above] += 1
+    return bin_idx
+
+
+def _nearest_dim(s, grid):
+    '''
+    Same as np.argmin(np.abs(grid - s)), for an array s
+    '''
+    step = _uniform_step(grid)
+    if step is not None:
+        guess = np.clip(np.rint((s - grid[0])/step), 0, grid.size - 1)
+    elif np.all(np.diff(grid) > 0):
+        guess = np.clip(np.searchsorted(grid, s), 0, grid.size - 1)
+    else:
+        return np.argmin(np.abs(grid[np.newaxis, :] - s[:, np.newaxis]),
+                         axis=1)
+    guess[~np.isfinite(s)] = 0  # same as argmin
+    guess = guess.astype(int)
+
+    # the closest grid point is at most one away from the guess
+    # ties go to the lower index, same as argmin
+    grid_idx = guess.copy()
+    upper = np.minimum(guess + 1, grid.size - 1)
+    closer = np.abs(grid[upper] - s) < np.abs(grid[grid_idx] - s)
+    grid_idx[closer] = upper[closer]
+    lower = np.maximum(guess - 1, 0)
+    closer = np.abs(grid[lower] - s) <= np.abs(grid[grid_idx] - s)
+    grid_idx[closer] = lower[closer]
+    return grid_idx
+
+
+def digitize_s_batch(S, s_grid, shape=None, to_bin=True):
+    '''
+    Batched version of `digitize_s`, for an (N, n_states) array of states.
+    For grids with uniform spacing (e.g. made with np.linspace), the indices
+    are computed directly instead of searching through the grid.
+
+    output:
+    - either an (N, n_states) array of indices
+    - an (N, ) array of raveled indices
+    '''
+    S = np.asarray(S, dtype=float)
+    if S.ndim == 1 and len(s_grid) == 1:
+        S = S[:, np.newaxis]
+    S = np.atleast_2d(S)
+
+    s_idx = np.zeros(S.shape, dtype=int)
+    for dim_idx, grid in enumerate(s_grid):
+        grid = np.asarray(grid)
+        if to_bin:
+            s_idx[:, dim_idx] = _digitize_dim(S[:, dim_idx], grid)
+        else:
+            s_idx[:, dim_idx] = _nearest_dim(S[:, dim_idx], grid)
+
+    if shape is None:
+        return s_idx
+    else:
+        return np.ravel_multi_index(tuple(s_idx.T), shape)
+
+
+# default number of state-action pairs evaluated per chunk
+CHUNK_SIZE = 10000
+# same, for batched models (see `simulate_state_actions`): large enough that
+# the per-chunk overhead vanishes, small enough to bound the memory used
+BATCH_CHUNK_SIZE = 2**18
+
+
+def get_state_actions(grids, start=0, stop=None, indices=None):
+    '''
+    Get the state-action pairs with flat grid indices [start, stop), in the
+    same order as `it.product(*grids['states'], *grids['actions'])`, as an
+    array of shape (stop-start, n_states+n_actions).
+    Only the requested chunk is created, not the whole product.
+    - indices: array of flat grid indices, to get instead of [start, stop)
+    '''
+    sa_grids = tuple(grids['states']) + tuple(grids['actions'])
+    sa_shape = tuple(map(np.size, sa_grids))
+    if indices is None:
+        if stop is None:
+            stop = np.prod(sa_shape, dtype=int)
+        indices = np.arange(start, stop)
+    sa_idx = np.unravel_index(indices, sa_shape)
+    return np.column_stack([np.asarray(grid)[idx]
+                            for grid, idx in zip(sa_grids, sa_idx)])
+
+
+def iterate_chunks(total, chunk_size=None):
+    '''
+    Split the flat indices [0, total) into chunks, yields (start, stop)
+    '''
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    for start in range(0, total, chunk_size):
+        yield start, min(start + chunk_size, total)
+
+
+def allocate_Q_map(grids, check_grid=False, keep_coords=False, zeros=None,
+                   total_gridpoints=None):
+    '''
+    Allocate the flat output arrays of `compute_Q_map` as a dict.
+    Pass in `zeros` to use something other than np.zeros, e.g. to allocate in
+    shared or memory-mapped storage. It is called as zeros(name, shape, dtype)
+    total_gridpoints: defaults to the size of the state-action grid
+    '''
+    if zeros is None:
+        def zeros(name, shape, dtype):
+            return np.zeros(shape, dtype=dtype)
+
+    if total_gridpoints is None:
+        s_grid_shape = list(map(np.size, grids['states']))
+        a_grid_shape = list(map(np.size, grids['actions']))
+        total_gridpoints = int(np.prod(s_grid_shape)*np.prod(a_grid_shape))
+
+    out = {'Q_map': zeros('Q_map', (total_gridpoints, ), int),
+           'Q_F': zeros('Q_F', (total_gridpoints, ), bool)}
+    if check_grid:
+        out['Q_on_grid'] = zeros('Q_on_grid', (total_gridpoints, ), bool)
+    if keep_coords:
+        out['Q_reached'] = zeros('Q_reached', (len(grids['states']),
+                                               total_gridpoints), float)
+    return out
+
+
+def store_transitions(out, start, stop, S_next, failed, grids,
+                      check_grid=False):
+    '''
+    Bin the states reached from the flat grid indices [start, stop), and
+    write them into the output arrays `out` (see `allocate_Q_map`).
+    S_next: (stop-start, n_states) array of states reached
+    failed: (stop-start, ) array of booleans
+    '''
+    s_grid_shape = tuple(map(np.size, grids['states']))
+    s_bin_shape = tuple(dim+1 for dim in s_grid_shape)
+    S_next = np.asarray(S_next, dtype=float).reshape(stop - start, -1)
+    failed = np.asarray(failed, dtype=bool).reshape(-1)
+
+    if 'Q_reached' in out:
+        out['Q_reached'][:, start:stop] = S_next.T
+
+    # note: Q_map is implicitly already excluding transitions that
+    # move straight to a failure. While this is not equivalent to the
+    # algorithm in the paper, for our systems it is a bit faster
+    Q_map = np.zeros(stop - start, dtype=int)
+    Q_map[~failed] = digitize_s_batch(S_next[~failed], grids['states'],
+                                      s_bin_shape)
+    if check_grid:
+        # check if s happens to be right on the grid-point
+        on_grid = ~failed
+        for sdx, grid in enumerate(grids['states']):
+            on_grid &= np.isin(S_next[:, sdx], grid)
+        Q_map[on_grid] = digitize_s_batch(S_next[on_grid], grids['states'],
+                                          s_grid_shape, to_bin=False)
+        out['Q_on_grid'][start:stop] = on_grid
+
+    out['Q_map'][start:stop] = Q_map
+    out['Q_F'][start:stop] = failed
+
+
+def model_parameters(p_map):
+    '''
+    The parameters p_map.p, with the integration profile set as an attribute
+    of p_map (see `slip.integration_options`) added as an explicit entry, so
+    that it is part of cache keys and checkpoints, and reaches worker
+    processes, which import p_map anew without the attribute. An entry
+    already in p_map.p takes precedence, as in the models.
+    '''
+    p = p_map.p
+    profile = getattr(p_map, 'integration_profile', None)
+    if profile is not None and 'integration_profile' not in p:
+        p = dict(p, integration_profile=profile)
+    return p
+
+
+def simulate_state_actions(SA, n_states, p_map, p, sa2xp, xp2s,
+                           batch=False):
+    '''
+    Evaluate the transition map for each row of SA (see `get_state_actions`)
+    - batch: if p_map, sa2xp and xp2s all have a `batch` attribute, use
+    these to evaluate all rows at once (see e.g. `slip.p_map_batch`)
+    returns
+    S_next: (N, n_states) array of the states reached
+    failed: (N, ) array of booleans
+    '''
+    if batch and all(hasattr(f, 'batch') for f in (p_map, sa2xp, xp2s)):
+        X, P = sa2xp.batch(SA, p)
+        X_next, failed = p_map.batch(X, P)
+        S_next = np.reshape(xp2s.batch(X_next, P), (len(SA), n_states))
+        return S_next, np.asarray(failed, dtype=bool)
+    S_next = np.zeros((len(SA), n_states))
+    failed = np.zeros(len(SA), dtype=bool)
+    for idx, state_action in enumerate(SA):
+        x, p_sa = sa2xp(state_action, p)
+        x_next, failed[idx] = p_map(x, p_sa)
+        S_next[idx] = xp2s(x_next, p_sa)
+    return S_next, failed
+
+
+def deliver_Q_map(out, grids):
+    '''
+    Reshape the flat output arrays `out` into the list returned by
+    `compute_Q_map`: [Q_map, Q_F, (Q_on_grid), (Q_reached)]
+    '''
+    s_grid_shape = list(map(np.size, grids['states']))
+    a_grid_shape = list(map(np.size, grids['actions']))
+
+    deliver = [out['Q_map'].reshape(s_grid_shape + a_grid_shape),
+               out['Q_F'].reshape(s_grid_shape + a_grid_shape)]
+    if 'Q_on_grid' in out:
+        deliver.append(out['Q_on_grid'].reshape(s_grid_shape+a_grid_shape))
+    if 'Q_reached' in out:
+        deliver.append(out['Q_reached'])
+
+    return deliver
+
+
 def compute_Q_map(grids, p_map, verbose=0, check_grid=False,
-                  keep_coords=False):
+                  keep_coords=False, chunk_size=None, batch=False):
     ''' Compute the transition map of a system
     NOTES
     - s_grid and a_grid have to be iterable lists of lists
     e.g. if they have only 1 dimension, they should be `s_grid = ([1, 2], )`
     - use p_map to carry parameters
     - keep_coords: toggle to true to also output an array of actual states
+    - chunk_size: number of state-action pairs created and binned at once.
+    Apart from the outputs, memory use does not grow with the grid size.
+    Defaults to CHUNK_SIZE, or BATCH_CHUNK_SIZE with batch.
+    - batch: simulate each chunk in one call, if the model provides batched
+    versions of p_map, sa2xp and xp2s (see `simulate_state_actions`)
     '''
     # TODO get rid of check_grid, solve the problem permanently
+    if chunk_size is None and batch:
+        chunk_size = BATCH_CHUNK_SIZE
 
     # initialize 1D, reshape later
-    # shape of state-space grid
-    s_grid_shape = list(map(np.size, grids['states']))
-    s_bin_shape = tuple(dim+1 for dim in s_grid_shape)
-    a_grid_shape = list(map(np.size, grids['actions']))
-    total_gridpoints = np.prod(s_grid_shape)*np.prod(a_grid_shape)
+    out = allocate_Q_map(grids, check_grid, keep_coords)
+    total_gridpoints = out['Q_map'].size
 
     if verbose > 0:
         print('computing a total of ' + str(total_gridpoints) + ' points.')
 
-    Q_map = np.zeros((total_gridpoints, 1), dtype=int)
-    Q_F = np.zeros((total_gridpoints, 1), dtype=bool)
-    if keep_coords:
-        Q_reached = np.zeros((len(grids['states']), total_gridpoints))
-
-    if check_grid:
-        Q_on_grid = np.copy(Q_F)  # HACK: keep track of wether you are in a bin
-
-    for idx, state_action in enumerate(np.array(list(
-            it.product(*grids['states'], *grids['actions'])))):
+    for start, stop in iterate_chunks(total_gridpoints, chunk_size):
+        S_next, failed = simulate_state_actions(
+            get_state_actions(grids, start, stop), len(grids['states']),
+            p_map, p_map.p, p_map.sa2xp, p_map.xp2s, batch)
+        store_transitions(out, start, stop, S_next, failed, grids,
+                          check_grid)
 
         if verbose > 1:
             # NOTE: requires running python unbuffered (python -u)
-            if idx % (total_gridpoints/10) == 0:
-                print('.', end=' ')
+            n_dots = np.count_nonzero(
+                np.arange(start, stop) % (total_gridpoints/10) == 0)
+            print('. '*n_dots, end='')
 
-        x, p = p_map.sa2xp(state_action, p_map.p)
+    return deliver_Q_map(out, grids)
 
-        x_next, failed = p_map(x, p)
 
-        s_next = p_map.xp2s(x_next, p)
-        if keep_coords:
-            Q_reached[:, idx] = s_next
-        if not failed:
-            # note: Q_map is implicitly already excluding transitions that
-            # move straight to a failure. While this is not equivalent to the
-            # algorithm in the paper, for our systems it is a bit faster
-            # bin_idx = np.digitize(state_val, s_grid[state_dx])
-            # sbin = np.digitize(s_next, s)
-            if check_grid:
-                for sdx, sval in enumerate(np.atleast_1d(s_next)):
-                    if ~np.isin(sval, grids['states'][sdx]):
-                        Q_map[idx] = digitize_s(s_next, grids['states'],
-                                                s_bin_shape)
-                        break
-                else:
-                    Q_on_grid[idx] = True
-                    Q_map[idx] = digitize_s(s_next, grids['states'],
-                                            s_grid_shape, to_bin=False)
-            else:
-                Q_map[idx] = digitize_s(s_next, grids['states'], s_bin_shape)
-
-            # check if s happens to be right on the grid-point
+def _match_grid(grid, old_grid):
+    '''
+    For each point of grid, the index of the same point in old_grid, or -1.
+    Points match up to round-off, e.g. for grids made with np.linspace.
+    '''
+    grid = np.asarray(grid, dtype=float)
+    old_grid = np.asarray(old_grid, dtype=float)
+    tol = 1e-9*max(np.ptp(grid), np.ptp(old_grid), 1e-12)
+    idx = np.clip(np.searchsorted(old_grid, grid), 1, old_grid.size - 1)
+    idx = np.where(np.abs(grid - old_grid[idx - 1])
+                   <= np.abs(grid - old_grid[idx]), idx - 1, idx)
+    idx[np.abs(grid - old_grid[idx]) > tol] = -1
+    return idx
+
+
+def _match_state_actions(grids, old_grids):
+    '''
+    Returns a function, which maps the flat grid indices [start, stop) of
+    grids to the flat indices of the same state-action pairs on old_grids.
+    It returns a boolean array of which pairs are also on old_grids, and
+    their flat indices there.
+    '''
+    if len(old_grids['states']) != len(grids['states']) or (
+            len(old_grids['actions']) != len(grids['actions'])):
+        raise ValueError('old_grids and grids need the same dimensions')
+    sa_grids = tuple(grids['states']) + tuple(grids['actions'])
+    old_sa_grids = tuple(old_grids['states']) + tuple(old_grids['actions'])
+    sa_shape = tuple(map(np.size, sa_grids))
+    old_shape = tuple(map(np.size, old_sa_grids))
+    matches = [_match_grid(grid, old_grid)
+               for grid, old_grid in zip(sa_grids, old_sa_grids)]
+
+    def match(start, stop):
+        old_idx = [matched[idx] for matched, idx
+                   in zip(matches, np.unravel_index(np.arange(start, stop),
+                                                    sa_shape))]
+        found = np.all([idx >= 0 for idx in old_idx], axis=0)
+        return found, np.ravel_multi_index(
+            tuple(idx[found] for idx in old_idx), old_shape)
+    return match
+
+
+def _flat_transitions(Q_F, Q_reached, n_states):
+    Q_F = np.asarray(Q_F, dtype=bool).reshape(-1)
+    Q_reached = np.asarray(Q_reached, dtype=float).reshape(n_states, -1)
+    if Q_reached.shape[1] != Q_F.size:
+        raise ValueError('Q_reached has ' + str(Q_reached.shape[1])
+                         + ' entries, but Q_F ' + str(Q_F.size))
+    return Q_F, Q_reached
+
+
+def rebin(Q_reached, Q_F, grids, check_grid=False, old_grids=None,
+          chunk_size=None):
+    '''
+    Recompute the transition map from the states reached (output of
+    `compute_Q_map` with keep_coords), without simulating again, e.g. to
+    try another state grid or check_grid.
+    - Q_reached: (n_states, n_state_actions) array of states reached
+    - Q_F: failures, either flat or on the state-action grid
+    - grids: grids to bin onto
+    - old_grids: grids Q_reached was computed on, if not the same. Each
+    state-action pair of grids has to be on old_grids (e.g. a coarser grid,
+    or a subset); otherwise, use `refine_Q_map`.
+    - chunk_size: number of states binned at once, defaults to
+    BATCH_CHUNK_SIZE
+    returns [Q_map, Q_F, (Q_on_grid)], as `compute_Q_map`
+    '''
+    if chunk_size is None:
+        chunk_size = BATCH_CHUNK_SIZE
+    Q_F, Q_reached = _flat_transitions(Q_F, Q_reached,
+                                       len(grids['states']))
+    out = allocate_Q_map(grids, check_grid)
+    if old_grids is None:
+        if Q_F.size != out['Q_F'].size:
+            raise ValueError('Q_F has ' + str(Q_F.size) + ' entries, but '
+                             'the grids ' + str(out['Q_F'].size)
+                             + '. Pass in old_grids.')
+        match = None
+    else:
+        match = _match_state_actions(grids, old_grids)
+
+    for start, stop in iterate_chunks(out['Q_F'].size, chunk_size):
+        if match is None:
+            old_flat = np.arange(start, stop)
         else:
-            Q_F[idx] = 1
+            found, old_flat = match(start, stop)
+            if not np.all(found):
+                raise ValueError('not all state-action pairs of grids are on'
+                                 ' old_grids, use refine_Q_map instead')
+        store_transitions(out, start, stop, Q_reached[:, old_flat].T,
+                          Q_F[old_flat], grids, check_grid)
+
+    return deliver_Q_map(out, grids)
+
+
+def refine_Q_map(grids, p_map, old_grids, Q_F, Q_reached, verbose=0,
+                 check_grid=False, keep_coords=False, chunk_size=None,
+                 batch=False):
+    ''' Compute the transition map of a system on the grids, reusing a
+    result on old_grids (computed with keep_coords) for all state-action pairs
+    which are on both grids, e.g. after doubling the resolution.
+    Only the new state-action pairs are simulated; the states reached from
+    all of them are binned onto the new state grid (see also `rebin`).
+    - Q_F, Q_reached: outputs of `compute_Q_map` on old_grids
+    - other options: see `compute_Q_map`
+    returns the same as `compute_Q_map` on grids
+    '''
+    match = _match_state_actions(grids, old_grids)
+    old_F, old_reached = _flat_transitions(Q_F, Q_reached,
+                                           len(grids['states']))
+    if chunk_size is None and batch:
+        chunk_size = BATCH_CHUNK_SIZE
+
+    out = allocate_Q_map(grids, check_grid, keep_coords)
+    total_gridpoints = out['Q_map'].size
+    n_reused = 0
+    for start, stop in iterate_chunks(total_gridpoints, chunk_size):
+        reused, old_flat = match(start, stop)
+        S_next = np.zeros((stop - start, len(grids['states'])))
+        failed = np.zeros(stop - start, dtype=bool)
+        S_next[reused] = old_reached[:, old_flat].T
+        failed[reused] = old_F[old_flat]
+        new = np.flatnonzero(~reused)
+        if new.size > 0:
+            S_next[new], failed[new] = simulate_state_actions(
+                get_state_actions(grids, indices=start + new),
+                len(grids['states']), p_map, p_map.p, p_map.sa2xp,
+                p_map.xp2s, batch)
+        store_transitions(out, start, stop, S_next, failed, grids,
+                          check_grid)
+        n_reused += old_flat.size
+
+    if verbose > 0:
+        print('reused ' + str(n_reused) + ', simulated '
+              + str(total_gridpoints - n_reused) + ' of '
+              + str(total_gridpoints) + ' points.')
+
+    return deliver_Q_map(out, grids)
 
-    Q_map = Q_map.reshape(s_grid_shape + a_grid_shape)
-    Q_F = Q_F.reshape(s_grid_shape + a_grid_shape)
 
-    deliver = [Q_map, Q_F]
+def _merge_parameters(Ps, n, per_point=()):
+    '''
+    Merge the parameter dicts Ps, each for a block of n points (see
+    `simulate_state_actions`), into one dict for all blocks, so that
+    p_map.batch can simulate all of them in one call. Entries are either the
+    same for all blocks, (n, ) arrays of per-point values, or in per_point
+    (the parameters p_map.batch accepts as arrays of per-point values).
+    returns None if the blocks cannot be merged
+    '''
+    merged = {}
+    for key in Ps[0]:
+        vals = [P.get(key) for P in Ps]
+        if all(isinstance(val, np.ndarray) and val.shape == (n, )
+               for val in vals):
+            merged[key] = np.concatenate(vals)
+        elif all(_same_setup(val, vals[0]) for val in vals[1:]):
+            merged[key] = vals[0]
+        elif key in per_point and all(np.size(val) in (1, n)
+                                      for val in vals):
+            merged[key] = np.concatenate([
+                np.broadcast_to(np.asarray(val, dtype=float).reshape(-1),
+                                (n, )) for val in vals])
+        else:
+            return None
+    return merged
 
+
+def simulate_parameter_sets(SA, n_states, p_map, ps, sa2xp, xp2s,
+                            batch=False):
+    '''
+    Same as `simulate_state_actions`, for each parameter dict in the list ps.
+    With batch, the states and parameters of all parameter sets are merged,
+    and simulated in a single call of p_map.batch, if the parameters which
+    differ are in p_map.batch.per_point.
+    returns
+    S_next: (K, N, n_states) array of the states reached
+    failed: (K, N) array of booleans
+    '''
+    if batch and all(hasattr(f, 'batch') for f in (p_map, sa2xp, xp2s)):
+        XPs = [sa2xp.batch(SA, p) for p in ps]
+        P = _merge_parameters([P for _, P in XPs], len(SA),
+                              getattr(p_map.batch, 'per_point', ()))
+        if P is not None:
+            X_next, failed = p_map.batch(
+                np.concatenate([X for X, _ in XPs]), P)
+            S_next = xp2s.batch(X_next, P)
+            return (np.reshape(S_next, (len(ps), len(SA), n_states)),
+                    np.reshape(failed, (len(ps), len(SA))).astype(bool))
+    S_next = np.zeros((len(ps), len(SA), n_states))
+    failed = np.zeros((len(ps), len(SA)), dtype=bool)
+    for kdx, p in enumerate(ps):
+        S_next[kdx], failed[kdx] = simulate_state_actions(
+            SA, n_states, p_map, p, sa2xp, xp2s, batch)
+    return S_next, failed
+
+
+def compute_Q_map_multi(grids, p_map, ps, verbose=0, check_grid=False,
+                        keep_coords=False, chunk_size=None, batch=False):
+    ''' Compute the transition maps of a system for each of the parameter
+    dicts in the list ps (instead of p_map.p), on the same grids. Each chunk
+    of state-action pairs is set up once for all parameter sets, and with
+    batch, all parameter sets are simulated together (see
+    `simulate_parameter_sets`).
+    - chunk_size: number of state-action pairs per chunk, for all parameter
+    sets together. Defaults to CHUNK_SIZE, or BATCH_CHUNK_SIZE with batch.
+    - other options: see `compute_Q_map`
+    returns the same as `compute_Q_map`, with all arrays stacked along a
+    first axis of length K = len(ps), e.g. Q_map has shape (K, *grid)
+    '''
+    if chunk_size is None:
+        chunk_size = BATCH_CHUNK_SIZE if batch else CHUNK_SIZE
+    ps = list(ps)
+    n_sets = len(ps)
+    s_grid_shape = list(map(np.size, grids['states']))
+    a_grid_shape = list(map(np.size, grids['actions']))
+    n_points = int(np.prod(s_grid_shape)*np.prod(a_grid_shape))
+
+    # initialize 1D, reshape later
+    out = allocate_Q_map(grids, check_grid, keep_coords,
+                         total_gridpoints=n_sets*n_points)
+
+    if verbose > 0:
+        print('computing a total of ' + str(n_sets*n_points) + ' points.')
+
+    for start, stop in iterate_chunks(n_points,
+                                      max(1, chunk_size // n_sets)):
+        S_next, failed = simulate_parameter_sets(
+            get_state_actions(grids, start, stop), len(grids['states']),
+            p_map, ps, p_map.sa2xp, p_map.xp2s, batch)
+        for kdx in range(n_sets):
+            store_transitions(out, kdx*n_points + start, kdx*n_points + stop,
+                              S_next[kdx], failed[kdx], grids, check_grid)
+
+    shape = [n_sets] + s_grid_shape + a_grid_shape
+    deliver = [out['Q_map'].reshape(shape), out['Q_F'].reshape(shape)]
     if check_grid:
-        deliver.append(Q_on_grid.reshape(s_grid_shape+a_grid_shape))
+        deliver.append(out['Q_on_grid'].reshape(shape))
     if keep_coords:
-        deliver.append(Q_reached)
-
+        deliver.append(np.moveaxis(out['Q_reached'].reshape(
+            len(s_grid_shape), n_sets, n_points), 1, 0))
     return deliver
 
 
@@ -269,6 +717,149 @@ def compute_QV(Q_map, grids, Q_V=None, Q_on_grid=None):
     return Q_V, S_V
 
 
+def compute_QV_graph(Q_map, grids, Q_V=None, Q_on_grid=None):
+    '''
+    Same as `compute_QV`, but instead of sweeping over all of Q_V until S_V
+    stops changing, failures are propagated backwards through the transition
+    map. The reverse graph (which state-action pairs land next to which grid
+    point) is built once from Q_map, each state keeps a count of its viable
+    actions, and states that run out of viable actions are pushed onto a
+    worklist. Each edge of the graph is touched once.
+    Returns the same (Q_V, S_V) as `compute_QV`.
+    '''
+
+    s_grid_shape = list(map(np.size, grids['states']))
+    n_states = np.prod(s_grid_shape, dtype=int)
+
+    if Q_V is None:
+        Q_V = Q_map.astype(bool)
+    Q_V = np.array(Q_V, dtype=bool).reshape(-1)
+    n_actions = Q_V.size // n_states
+
+    corners = get_corner_table(Q_map, grids, Q_on_grid)
+    # landing outside the grid is immediately outside of S_V
+    Q_V &= corners[:, 0] >= 0
+
+    # reverse graph, in CSR format: for each grid point, the (s, a) pairs
+    # that need it to stay viable
+    q_idx = np.flatnonzero(Q_V)
+    targets = corners[q_idx]
+    # on-grid transitions repeat the same grid point for every corner
+    duplicate = np.zeros(targets.shape, dtype=bool)
+    duplicate[:, 1:] = targets[:, 1:] == targets[:, :1]
+    sources = np.repeat(q_idx, targets.shape[1])[~duplicate.reshape(-1)]
+    targets = targets[~duplicate]
+    order = np.argsort(targets, kind='stable')
+    sources = sources[order]
+    indptr = np.zeros(n_states + 1, dtype=int)
+    np.cumsum(np.bincount(targets, minlength=n_states), out=indptr[1:])
+
+    # number of viable actions left for each state
+    n_viable = Q_V.reshape(n_states, n_actions).sum(axis=1)
+    frontier = np.flatnonzero(n_viable == 0)
+
+    while frontier.size > 0:
+        # collect all (s, a) landing next to a newly non-viable state
+        starts = indptr[frontier]
+        lengths = indptr[frontier + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        hits = np.unique(sources[np.arange(lengths.sum()) + offsets])
+        hits = hits[Q_V[hits]]
+        Q_V[hits] = False
+        # decrement the count of viable actions of the affected states
+        affected = hits // n_actions
+        n_viable -= np.bincount(affected, minlength=n_states)
+        affected = np.unique(affected)
+        frontier = affected[n_viable[affected] == 0]
+
+    Q_V = Q_V.reshape(Q_map.shape)
+    S_V = project_Q2S(Q_V, grids)
+
+    return Q_V, S_V
+
+
+def compute_QV_vectorized(Q_map, grids, Q_V=None, Q_on_grid=None, verbose=0,
+                          Q_pinned=None):
+    '''
+    Same fixed-point iteration as `compute_QV`, but each sweep is done with
+    whole-array operations: the enclosing grid points of every state-action
+    pair are looked up once (see `get_corner_table`), and each sweep is then a
+    single gather from S_V followed by an all-reduce.
+    - Q_pinned: boolean array, marking state-action pairs whose value in Q_V
+    is kept fixed, e.g. estimates for pairs that were not simulated (their
+    Q_map entries are ignored)
+    Returns the same (Q_V, S_V) as `compute_QV`.
+    '''
+
+    s_grid_shape = list(map(np.size, grids['states']))
+    n_states = np.prod(s_grid_shape, dtype=int)
+
+    if Q_V is None:
+        Q_V = Q_map.astype(bool)
+    Q_V = np.array(Q_V, dtype=bool).reshape(-1)
+    if Q_pinned is None:
+        free = np.ones(Q_V.size, dtype=bool)
+    else:
+        free = ~np.asarray(Q_pinned, dtype=bool).reshape(-1)
+
+    corners = get_corner_table(Q_map, grids, Q_on_grid)
+    # landing outside the grid is always outside of S_V
+    Q_V &= (corners[:, 0] >= 0) | ~free
+
+    S_V = Q_V.reshape(n_states, -1).any(axis=1)
+    S_old = np.zeros_like(S_V)
+    iterations = 0
+    while not np.array_equal(S_V, S_old):
+        q_idx = np.flatnonzero(Q_V & free)
+        Q_V[q_idx] = S_V[corners[q_idx]].all(axis=1)
+        S_old = S_V
+        S_V = Q_V.reshape(n_states, -1).any(axis=1)
+        iterations += 1
+
+    if verbose > 0:
+        print('converged after ' + str(iterations) + ' iterations.')
+
+    return Q_V.reshape(Q_map.shape), S_V.reshape(s_grid_shape)
+
+
+def compute_QV_stacked(Q_map, grids, Q_V=None, Q_on_grid=None, verbose=0):
+    '''
+    Same as `compute_QV_vectorized`, for a stack of transition maps on the
+    same grids (see `compute_Q_map_multi`), all computed at once: Q_map (and
+    Q_V, Q_on_grid) have shape (K, *grid).
+    Returns Q_V (K, *grid) and S_V (K, *s_grid)
+    '''
+    s_grid_shape = list(map(np.size, grids['states']))
+    n_states = np.prod(s_grid_shape, dtype=int)
+    n_sets = Q_map.shape[0]
+
+    if Q_V is None:
+        Q_V = Q_map.astype(bool)
+    Q_V = np.array(Q_V, dtype=bool).reshape(-1)
+
+    corners = get_corner_table(Q_map, grids, Q_on_grid)
+    # landing outside the grid is always outside of S_V
+    Q_V &= corners[:, 0] >= 0
+    # index into the stacked S_V of each transition map
+    corners += (np.arange(Q_V.size) // (Q_V.size // n_sets)
+                * n_states)[:, np.newaxis]
+
+    S_V = Q_V.reshape(n_sets*n_states, -1).any(axis=1)
+    S_old = np.zeros_like(S_V)
+    iterations = 0
+    while not np.array_equal(S_V, S_old):
+        q_idx = np.flatnonzero(Q_V)
+        Q_V[q_idx] = S_V[corners[q_idx]].all(axis=1)
+        S_old = S_V
+        S_V = Q_V.reshape(n_sets*n_states, -1).any(axis=1)
+        iterations += 1
+
+    if verbose > 0:
+        print('converged after ' + str(iterations) + ' iterations.')
+
+    return Q_V.reshape(Q_map.shape), S_V.reshape([n_sets] + s_grid_shape)
+
+
 def is_outside(s, s_grid, S_V, already_binned=True, on_grid=False):
     '''
     given a level set S, check if s lands in a bin inside of S or not
@@ -299,9 +890,10 @@ def is_outside(s, s_grid, S_V, already_binned=True, on_grid=False):
 
     return False
     # for dim_idx, grid in enumerate(s_grid):
-    #     # if outside the left-most or right-most side of grid, mark as outside
-    #     # * NOTE: this can result in disastrous underestimations if the grid is
-    #     # * not larger than the viable set!
+    #     # if outside the left-most or right-most side of grid, mark as
+    #     # outside
+    #     # * NOTE: this can result in disastrous underestimations if the grid
+    #     # * is not larger than the viable set!
     #     # TODO: this can lead to understimation if s is right on the gridline
     #     # because it will still check its neighbors. need to first check.
     #     if bin_idx[dim_idx] == 0:
@@ -342,6 +934,49 @@ def get_grid_indices(bin_idx, s_grid):
     return grid_coords
 
 
+def _grid_corners(bin_idx, s_grid_shape):
+    '''
+    Vectorized `get_grid_indices`: from an (N, n) array of unraveled bin
+    indices, get an (N, 2**n) array of the raveled surrounding grid indices,
+    in the same order as `get_grid_indices`. Rows of bins on the grid edge
+    are filled with -1.
+    '''
+    bin_idx = np.asarray(bin_idx, dtype=int)
+    n_dims = len(s_grid_shape)
+    inside = np.all((bin_idx > 0) & (bin_idx < np.array(s_grid_shape)),
+                    axis=1)
+    # bits of each corner, same ordering as it.product
+    offsets = np.array(list(it.product((1, 0), repeat=n_dims)), dtype=int)
+    coords = bin_idx[:, np.newaxis, :] - offsets[np.newaxis, :, :]
+    coords[~inside] = 0
+    corners = np.ravel_multi_index(tuple(np.moveaxis(coords, -1, 0)),
+                                   s_grid_shape)
+    corners[~inside] = -1
+    return corners
+
+
+def get_corner_table(Q_map, grids, Q_on_grid=None):
+    '''
+    For every state-action pair of Q_map, get the raveled indices of the
+    grid points enclosing the bin it lands in, as an (Q_map.size, 2**n) array.
+    Pairs landing outside the grid have a row of -1, and pairs landing
+    exactly on a grid point (see `Q_on_grid`) repeat that grid point.
+    This is the lookup used by `is_outside`, precomputed for the whole grid.
+    '''
+    s_grid_shape = tuple(map(np.size, grids['states']))
+    s_bin_shape = tuple(x+1 for x in s_grid_shape)
+    Q_flat = np.asarray(Q_map).reshape(-1).astype(int)
+
+    bin_idx = np.column_stack(np.unravel_index(Q_flat, s_bin_shape))
+    corners = _grid_corners(bin_idx, s_grid_shape)
+
+    if Q_on_grid is not None:
+        on_grid = np.asarray(Q_on_grid, dtype=bool).reshape(-1)
+        corners[on_grid] = Q_flat[on_grid, np.newaxis]
+
+    return corners
+
+
 def map_S2Q(Q_map, S_M, s_grid, Q_V=None, Q_on_grid=None):
     '''
     map the measure of robustness of S to the state action space Q, via
@@ -357,27 +992,31 @@ def map_S2Q(Q_map, S_M, s_grid, Q_V=None, Q_on_grid=None):
         Q_V = Q_map.astype(bool)
 
     Q_M = np.zeros(Q_map.shape)
-    # iterate over viable state-action pairs in Q_V
-    for qdx, is_viable in np.ndenumerate(Q_V):
-        if is_viable:  # only check states-action pairs that are viable
-            if Q_on_grid[qdx]:
-                sdx = np.unravel_index(Q_map[qdx], S_M.shape)
-            else:
-                sdx = np.unravel_index(Q_map[qdx],
-                                       list(x+1 for x in S_M.shape))
-            edge_indices = get_grid_indices(sdx, s_grid)
-
-            # TODO check that it actually has the right size
-            measure = 0
-            # taking the average measure of all enclosing grid-points
-            if len(edge_indices) > 0:
-                for idx in edge_indices:
-                    measure += S_M[(idx)]
-                measure /= len(edge_indices)
-
-            # If sdx is on the outer edge, don't map it
-
-            Q_M[qdx] = measure
+    # only map viable state-action pairs
+    q_idx = np.flatnonzero(Q_V)
+    Q_flat = Q_map.reshape(-1)[q_idx].astype(int)
+    on_grid = Q_on_grid.reshape(-1)[q_idx]
+
+    # look up the enclosing grid-points of all pairs at once. Note, pairs
+    # landing on a grid point are indexed in the grid instead of the bins.
+    s_grid_shape = S_M.shape
+    sdx = np.zeros((q_idx.size, len(s_grid_shape)), dtype=int)
+    sdx[on_grid] = np.column_stack(np.unravel_index(Q_flat[on_grid],
+                                                    s_grid_shape))
+    sdx[~on_grid] = np.column_stack(np.unravel_index(
+        Q_flat[~on_grid], tuple(x+1 for x in s_grid_shape)))
+    corners = _grid_corners(sdx, s_grid_shape)
+
+    # taking the average measure of all enclosing grid-points
+    # If sdx is on the outer edge, don't map it
+    inside = corners[:, 0] >= 0
+    S_flat = S_M.reshape(-1)
+    measure = np.zeros(np.count_nonzero(inside))
+    for edge_indices in corners[inside].T:  # same summation order as before
+        measure += S_flat[edge_indices]
+    measure /= corners.shape[1]
+
+    Q_M.reshape(-1)[q_idx[inside]] = measure
 
     return Q_M
 
@@ -400,19 +1039,20 @@ def get_feasibility_mask(feasible, sa2xp, grids, x0, p0):
     a_shape = list(map(np.size, grids['actions']))
     Q_feasible = np.zeros(np.prod(s_shape)*np.prod(a_shape), dtype=bool)
 
-    # TODO: can probably simplify this
-    for idx, state_action in enumerate(np.array(list(
-            it.product(*grids['states'], *grids['actions'])))):
-        x, p = sa2xp(state_action, p0)
-        Q_feasible[idx] = feasible(x, p)
+    for start, stop in iterate_chunks(Q_feasible.size):
+        for idx, state_action in enumerate(get_state_actions(grids,
+                                                             start, stop)):
+            x, p = sa2xp(state_action, p0)
+            Q_feasible[start + idx] = feasible(x, p)
 
     return Q_feasible.reshape(s_shape + a_shape)
 
 
 # def compute_Q_cont(grids, p_map, verbose=0):
-#     ''' Compute the transition map of a system, and output the result _without_
-#     discretizing into bins, as an array of coordinate vectors (n, m) where
-#     n is the dimensionality of state, and m are the number of grid-points
+#     ''' Compute the transition map of a system, and output the result
+#     _without_ discretizing into bins, as an array of coordinate vectors
+#     (n, m) where n is the dimensionality of state, and m are the number of
+#     grid-points
 #     NOTES
 #     - s_grid and a_grid have to be iterable lists of lists
 #     e.g. if they have only 1 dimension, they should be `s_grid = ([1, 2], )`
@@ -452,88 +1092,244 @@ def get_feasibility_mask(feasible, sa2xp, grids, x0, p0):
 #     return (Q_map, Q_F)
 
 
-def parcompute_Q_map(grids, p_map, verbose=0, check_grid=False,
-                     keep_coords=False):
-    ''' Compute the transition map of a system in parallel
-    - s_grid and a_grid have to be iterable lists of lists
-    e.g. if they have only 1 dimension, they should be `s_grid = ([1, 2], )`
-    - use p_map to carry parameters
-    - keep_coords: toggle to true to also output an array of actual states
+# state of each worker process of `parcompute_Q_map`, set by `_init_worker`
+_worker = {}
+
+
+def _create_shared(blocks, name, shape, dtype):
+    '''
+    Allocate a zero-filled array in a new shared memory block, and keep track
+    of the block in `blocks`. Use as `zeros` argument of `allocate_Q_map`.
     '''
+    from multiprocessing import shared_memory
+    dtype = np.dtype(dtype)
+    nbytes = max(1, int(np.prod(shape))*dtype.itemsize)
+    blocks[name] = shared_memory.SharedMemory(create=True, size=nbytes)
+    array = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+    array[...] = 0
+    return array
 
-    import multiprocessing as mp
 
-    # initialize 1D, reshape later
-    # shape of state-space grid
-    s_grid_shape = list(map(np.size, grids['states']))
-    s_bin_shape = tuple(dim+1 for dim in s_grid_shape)
-    a_grid_shape = list(map(np.size, grids['actions']))
-    total_gridpoints = np.prod(s_grid_shape)*np.prod(a_grid_shape)
-    if verbose > 0:
-        print('computing a total of ' + str(total_gridpoints) + ' points.')
+def _attach_outputs(specs):
+    '''
+    Attach to output arrays created in another process, described by
+    specs: {name: (kind, location, shape, dtype)}, where kind is either
+    'shm' (location is the name of a shared memory block) or
+    'memmap' (location is the path of a .npy file).
+    Returns the dict of arrays, and the dict of shared memory blocks, which
+    need to be kept around (and closed) as long as the arrays are in use.
+    '''
+    from multiprocessing import shared_memory
+    blocks = {}
+    arrays = {}
+    for name, (kind, location, shape, dtype) in specs.items():
+        if kind == 'shm':
+            blocks[name] = shared_memory.SharedMemory(name=location)
+            arrays[name] = np.ndarray(shape, dtype=dtype,
+                                      buffer=blocks[name].buf)
+        else:
+            arrays[name] = np.load(location, mmap_mode='r+')
+    return arrays, blocks
 
-    # initilize pool
-    pool = mp.Pool()
-    # create list of args
-    SA = list(it.product(*grids['states'], *grids['actions']))
-    # for sa in SA:
-    #     print(sa[1],end=' in a, and ')
-    p = p_map.p.copy()
-    args = [p_map.sa2xp(sa, p) for sa in SA]
-    # for ar in args:
-    #     print(ar[1]['angle_of_attack'], end='')
-    #     print(" and " + str(ar[0][1]))
-    # start pool with starmap
-    results = pool.starmap(p_map, args)
-    pool.close()
-
-    # for r in results:
-    #     print(r[0])
-
-    # do the standard stuff (put into bins etc.)
-
-    Q_map = np.zeros((total_gridpoints, 1), dtype=int)
-    Q_F = np.zeros((total_gridpoints, 1), dtype=bool)
-    if keep_coords:
-        Q_reached = np.zeros((len(grids['states']), total_gridpoints))
 
-    if check_grid:
-        Q_on_grid = np.copy(Q_F)  # HACK: keep track of wether you are in a bin
+def _same_setup(a, b):
+    '''
+    Recursively compare two (nested) dicts/lists/arrays for equality
+    '''
+    if isinstance(a, dict) and isinstance(b, dict):
+        return (a.keys() == b.keys()
+                and all(_same_setup(a[key], b[key]) for key in a))
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return (len(a) == len(b)
+                and all(_same_setup(x, y) for x, y in zip(a, b)))
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(a, b)
+    try:
+        return bool(a == b)
+    except ValueError:
+        return False
 
-    # TODO: no need to use it.product here, since we just use the index
-    for idx, sa in enumerate(np.array(list(it.product(*grids['states'],
-                                                      *grids['actions'])))):
 
-        x_next, failed = results[idx]
-        s_next = p_map.xp2s(x_next, p)
-        if keep_coords:
-            Q_reached[:, idx] = s_next
-        if not failed:
-            if check_grid:
-                for sdx, sval in enumerate(np.atleast_1d(s_next)):
-                    if ~np.isin(sval, grids['states'][sdx]):
-                        Q_map[idx] = digitize_s(s_next, grids['states'],
-                                                s_bin_shape)
-                        break
-                else:
-                    Q_on_grid[idx] = True
-                    Q_map[idx] = digitize_s(s_next, grids['states'],
-                                            s_grid_shape, to_bin=False)
-            else:
-                Q_map[idx] = digitize_s(s_next, grids['states'], s_bin_shape)
-
-            # check if s happens to be right on the grid-point
-        else:
-            Q_F[idx] = 1
+def _open_checkpoint(checkpoint, grids, setup, chunk_size):
+    '''
+    Open the memory-mapped output arrays and the bitmap of completed chunks
+    stored in the folder `checkpoint`, or create them if there is nothing to
+    resume. `setup` describes the computation, a checkpoint can only be
+    resumed for the same setup. The chunk size of an existing checkpoint
+    takes precedence over `chunk_size`.
+    Returns (out, done, chunk_size, specs)
+    '''
+    import os
+    import pickle
+
+    setup_file = os.path.join(checkpoint, 'setup.pickle')
+
+    def filename(name):
+        return os.path.join(checkpoint, name + '.npy')
+
+    if os.path.exists(setup_file):
+        with open(setup_file, 'rb') as infile:
+            stored = pickle.load(infile)
+        chunk_size = stored.pop('chunk_size')
+        if not _same_setup(stored, setup):
+            raise ValueError('checkpoint ' + str(checkpoint) + ' was created'
+                             ' for a different computation.')
+        out = allocate_Q_map(
+            grids, setup['check_grid'], setup['keep_coords'],
+            zeros=lambda name, shape, dtype: np.load(filename(name),
+                                                     mmap_mode='r+'))
+        done = np.load(filename('done'), mmap_mode='r+')
+    else:
+        os.makedirs(checkpoint, exist_ok=True)
+        out = allocate_Q_map(
+            grids, setup['check_grid'], setup['keep_coords'],
+            zeros=lambda name, shape, dtype: np.lib.format.open_memmap(
+                filename(name), mode='w+', dtype=dtype, shape=shape))
+        n_chunks = -(-out['Q_map'].size // chunk_size)
+        done = np.lib.format.open_memmap(filename('done'), mode='w+',
+                                         dtype=bool, shape=(n_chunks, ))
+        # only write the setup once everything else exists
+        with open(setup_file, 'wb') as outfile:
+            pickle.dump(dict(setup, chunk_size=chunk_size), outfile)
+
+    specs = {name: ('memmap', filename(name), val.shape, val.dtype.str)
+             for name, val in out.items()}
+    return out, done, chunk_size, specs
+
+
+def _init_worker(grids, p_map, p, sa2xp, xp2s, check_grid, batch, specs):
+    '''
+    Pool initializer: each worker receives the model and the base parameters
+    once, instead of a copy of the parameters with every task, and attaches
+    to the shared output arrays.
+    '''
+    out, blocks = _attach_outputs(specs)
+    _worker.update(grids=grids, p_map=p_map, p=p, sa2xp=sa2xp, xp2s=xp2s,
+                   check_grid=check_grid, batch=batch, out=out,
+                   blocks=blocks)
 
-    Q_map = Q_map.reshape(s_grid_shape + a_grid_shape)
-    Q_F = Q_F.reshape(s_grid_shape + a_grid_shape)
 
-    deliver = [Q_map, Q_F]
+def _compute_chunk(chunk):
+    '''
+    Pool task: simulate and bin the flat grid indices [start, stop), and
+    write the results directly into the shared output arrays.
+    '''
+    start, stop = chunk
+    grids = _worker['grids']
+    S_next, failed = simulate_state_actions(
+        get_state_actions(grids, start, stop), len(grids['states']),
+        _worker['p_map'], _worker['p'], _worker['sa2xp'], _worker['xp2s'],
+        _worker['batch'])
+    store_transitions(_worker['out'], start, stop, S_next, failed, grids,
+                      _worker['check_grid'])
+    # make sure results are on disk before the chunk is marked as done
+    for val in _worker['out'].values():
+        if isinstance(val, np.memmap):
+            val.flush()
+    return chunk
 
-    if check_grid:
-        deliver.append(Q_on_grid.reshape(s_grid_shape+a_grid_shape))
-    if keep_coords:
-        deliver.append(Q_reached)
 
-    return deliver
+def parcompute_Q_map(grids, p_map, verbose=0, check_grid=False,
+                     keep_coords=False, chunk_size=None, processes=None,
+                     checkpoint=None, batch=False, queue=None):
+    ''' Compute the transition map of a system in parallel
+    - s_grid and a_grid have to be iterable lists of lists
+    e.g. if they have only 1 dimension, they should be `s_grid = ([1, 2], )`
+    - use p_map to carry parameters
+    - keep_coords: toggle to true to also output an array of actual states
+    - chunk_size: number of state-action pairs per task. By default, the grid
+    is split into about 8 tasks per process, with at most CHUNK_SIZE pairs
+    (BATCH_CHUNK_SIZE with batch).
+    - processes: number of worker processes, defaults to the number of CPUs
+    - checkpoint: path to a folder. If given, the outputs are stored in
+    memory-mapped .npy files there, together with a bitmap of completed
+    chunks. Rerunning with the same checkpoint (after a crash, or being
+    interrupted) only simulates the missing chunks. The folder is not
+    deleted afterwards; the checkpoint can only be resumed for the same
+    grids, parameters and model.
+    - batch: simulate each chunk in one call, if the model provides batched
+    versions of p_map, sa2xp and xp2s (see `simulate_state_actions`)
+    - queue: path to a folder on a file system shared with other machines.
+    If given, the chunks are published there as a work queue, which workers
+    on any machine can join (see `workqueue.queue_compute_Q_map`), and
+    processes is the number of local workers. Like checkpoint, rerunning
+    with the same folder resumes.
+    The model and parameters are sent to each worker once, tasks only carry
+    a range of flat grid indices. Mapping state-actions to the simulation
+    (sa2xp) and binning the results is done inside the workers, which write
+    directly into output arrays in shared memory.
+    '''
+
+    import multiprocessing as mp
+
+    if queue is not None:
+        if checkpoint is not None:
+            raise ValueError('use either checkpoint or queue, not both')
+        from .workqueue import queue_compute_Q_map
+        return queue_compute_Q_map(grids, p_map, queue, processes, verbose,
+                                   check_grid, keep_coords, chunk_size,
+                                   batch)
+
+    if processes is None:
+        processes = mp.cpu_count()
+    p = model_parameters(p_map).copy()
+
+    # initialize 1D in shared memory (or files), reshape later
+    blocks = {}
+    try:
+        if checkpoint is None:
+            shared = allocate_Q_map(
+                grids, check_grid, keep_coords,
+                zeros=lambda *args: _create_shared(blocks, *args))
+            specs = {name: ('shm', blocks[name].name, val.shape,
+                            val.dtype.str)
+                     for name, val in shared.items()}
+        total_gridpoints = int(np.prod(list(map(np.size, grids['states'])))
+                               * np.prod(list(map(np.size,
+                                                  grids['actions']))))
+        if chunk_size is None:
+            chunk_size = int(np.clip(total_gridpoints // (8*processes), 1,
+                                     BATCH_CHUNK_SIZE if batch
+                                     else CHUNK_SIZE))
+        if checkpoint is not None:
+            setup = {'grids': grids, 'p': p, 'check_grid': check_grid,
+                     'keep_coords': keep_coords, 'batch': batch,
+                     'model': [getattr(f, '__module__', None)
+                               for f in (p_map, p_map.sa2xp, p_map.xp2s)]
+                     + [getattr(f, '__qualname__', None)
+                        for f in (p_map, p_map.sa2xp, p_map.xp2s)]}
+            shared, done, chunk_size, specs = _open_checkpoint(
+                checkpoint, grids, setup, chunk_size)
+        else:
+            done = np.zeros(-(-total_gridpoints // chunk_size), dtype=bool)
+
+        chunks = [(start, stop) for start, stop
+                  in iterate_chunks(total_gridpoints, chunk_size)
+                  if not done[start // chunk_size]]
+        if verbose > 0:
+            print('computing a total of ' + str(total_gridpoints)
+                  + ' points.')
+            if len(chunks) < done.size:
+                print('resuming, ' + str(len(chunks)) + ' of '
+                      + str(done.size) + ' chunks left.')
+
+        initargs = (grids, p_map, p, p_map.sa2xp, p_map.xp2s, check_grid,
+                    batch, specs)
+        with mp.Pool(processes, initializer=_init_worker,
+                     initargs=initargs) as pool:
+            for start, stop in pool.imap_unordered(_compute_chunk, chunks):
+                done[start // chunk_size] = True
+                if isinstance(done, np.memmap):
+                    done.flush()
+                if verbose > 1:
+                    print('.', end=' ')
+
+        # copy out of shared memory (or files) before releasing it
+        out = {name: np.array(val) for name, val in shared.items()}
+    finally:
+        shared = None
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+    return deliver_Q_map(out, grids)
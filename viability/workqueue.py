@@ -0,0 +1,332 @@
+'''
+File-based work queue, to compute a transition map with workers on several
+machines which share a file system (e.g. over NFS), without a scheduler or
+any network service. The folder of a queue contains
+- setup.pickle: the model, parameters, grids and options
+- tasks/: one empty file per chunk of the grid which is still to be done
+- claimed/: tasks which a worker is busy with. Workers claim a task by
+renaming it from tasks/, which is atomic, so each task goes to one worker.
+- results/: the binned transitions of each finished chunk, as .npz files.
+They are first written to a temporary file, and then renamed.
+- failed/: tasks which raised an error, with the traceback. They are
+retried when the queue is published again.
+Workers are started on any machine with `python -m viability <folder>`. The
+model (p_map, sa2xp, xp2s) has to be importable there, i.e. defined in a
+module and not in the script which publishes the queue.
+'''
+
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from .viability import (BATCH_CHUNK_SIZE, CHUNK_SIZE, _same_setup,
+                        allocate_Q_map, deliver_Q_map, get_state_actions,
+                        model_parameters, simulate_state_actions,
+                        store_transitions)
+
+# seconds after which a claimed task is assumed to belong to a worker that
+# died, and is put back in the queue
+STALE_TIMEOUT = 3600
+
+
+def _folder(path, name):
+    return os.path.join(path, name)
+
+
+def _task_name(idx):
+    return '{:08d}'.format(idx)
+
+
+def _result_file(path, idx):
+    return os.path.join(path, 'results', _task_name(idx) + '.npz')
+
+
+def _worker_id():
+    return socket.gethostname() + '-' + str(os.getpid())
+
+
+def _results_done(path):
+    return {int(name.split('.')[0])
+            for name in os.listdir(_folder(path, 'results'))
+            if name.endswith('.npz')}
+
+
+def _load_setup(path):
+    with open(os.path.join(path, 'setup.pickle'), 'rb') as infile:
+        return pickle.load(infile)
+
+
+def _chunk(setup, idx):
+    start = idx*setup['chunk_size']
+    return start, min(start + setup['chunk_size'], setup['total_gridpoints'])
+
+
+def publish_Q_map(path, grids, p_map, check_grid=False, keep_coords=False,
+                  chunk_size=None, batch=False):
+    '''
+    Publish the computation of the transition map as a queue of tasks in the
+    folder path (see `compute_Q_map` for the options). If the folder already
+    holds a queue for the same computation, only missing tasks are added,
+    e.g. after an interrupted publish; finished results are kept. The chunk
+    size of an existing queue takes precedence over chunk_size.
+    returns the number of tasks
+    '''
+    total_gridpoints = int(np.prod(list(map(np.size, grids['states'])))
+                           * np.prod(list(map(np.size, grids['actions']))))
+    if chunk_size is None:
+        chunk_size = BATCH_CHUNK_SIZE if batch else CHUNK_SIZE
+    setup = {'grids': grids, 'p_map': p_map, 'p': model_parameters(p_map),
+             'sa2xp': p_map.sa2xp, 'xp2s': p_map.xp2s,
+             'check_grid': check_grid, 'keep_coords': keep_coords,
+             'batch': batch, 'total_gridpoints': total_gridpoints}
+
+    setup_file = os.path.join(path, 'setup.pickle')
+    if os.path.exists(setup_file):
+        stored = _load_setup(path)
+        chunk_size = stored.pop('chunk_size')
+        if not _same_setup(stored, setup):
+            raise ValueError('queue ' + str(path) + ' was created for a'
+                             ' different computation.')
+        # retry failed tasks
+        for name in os.listdir(_folder(path, 'failed')):
+            os.remove(os.path.join(path, 'failed', name))
+    else:
+        for name in ('tasks', 'claimed', 'results', 'failed'):
+            os.makedirs(_folder(path, name), exist_ok=True)
+        # workers only start once the setup is complete
+        with open(setup_file + '.tmp', 'wb') as outfile:
+            pickle.dump(dict(setup, chunk_size=chunk_size), outfile)
+        os.replace(setup_file + '.tmp', setup_file)
+
+    n_tasks = -(-total_gridpoints // chunk_size)
+    present = _results_done(path)
+    present.update(int(name.split('.')[0])
+                   for folder in ('tasks', 'claimed')
+                   for name in os.listdir(_folder(path, folder)))
+    for idx in set(range(n_tasks)) - present:
+        open(os.path.join(path, 'tasks', _task_name(idx)), 'w').close()
+    return n_tasks
+
+
+def requeue_stale(path, stale_timeout=STALE_TIMEOUT):
+    '''
+    Put tasks which were claimed more than stale_timeout seconds ago, and
+    whose results are missing, back in the queue. If the worker was only slow
+    and still finishes, the chunk is simply computed twice.
+    NOTE: this compares the modification times of the claims with the clock
+    of this machine, keep the clocks roughly in sync.
+    returns the number of requeued tasks
+    '''
+    requeued = 0
+    now = time.time()
+    for name in os.listdir(_folder(path, 'claimed')):
+        claim = os.path.join(path, 'claimed', name)
+        idx = int(name.split('.')[0])
+        try:
+            if now - os.path.getmtime(claim) < stale_timeout:
+                continue
+            if os.path.exists(_result_file(path, idx)):
+                os.remove(claim)
+            else:
+                os.rename(claim, os.path.join(path, 'tasks',
+                                              _task_name(idx)))
+                requeued += 1
+        except FileNotFoundError:  # finished, or requeued by someone else
+            continue
+    return requeued
+
+
+def _compute_task(path, setup, idx, worker_id):
+    '''
+    Simulate and bin one chunk, and store the result
+    '''
+    result_file = _result_file(path, idx)
+    if os.path.exists(result_file):  # done already, before being requeued
+        return
+    start, stop = _chunk(setup, idx)
+    grids = setup['grids']
+    out = allocate_Q_map(grids, setup['check_grid'], setup['keep_coords'],
+                         total_gridpoints=stop - start)
+    S_next, failed = simulate_state_actions(
+        get_state_actions(grids, start, stop), len(grids['states']),
+        setup['p_map'], setup['p'], setup['sa2xp'], setup['xp2s'],
+        setup['batch'])
+    store_transitions(out, 0, stop - start, S_next, failed, grids,
+                      setup['check_grid'])
+    tmp_file = result_file + '.' + worker_id + '.tmp'
+    with open(tmp_file, 'wb') as outfile:
+        np.savez(outfile, **out)
+    os.replace(tmp_file, result_file)
+
+
+def run_worker(path, poll=1.0, stale_timeout=STALE_TIMEOUT, verbose=0):
+    '''
+    Claim and compute tasks of the queue in the folder path, until all tasks
+    are done. While waiting for tasks claimed by other workers, stale claims
+    are requeued (see `requeue_stale`).
+    - poll: seconds to wait before looking for tasks again
+    returns the number of tasks computed by this worker
+    '''
+    worker_id = _worker_id()
+    setup_file = os.path.join(path, 'setup.pickle')
+    while not os.path.exists(setup_file):
+        time.sleep(poll)
+    setup = _load_setup(path)
+    rng = np.random.default_rng()
+
+    n_computed = 0
+    while True:
+        # different orders for each worker, to rarely try the same task
+        tasks = rng.permutation(os.listdir(_folder(path, 'tasks')))
+        for name in tasks:
+            task = os.path.join(path, 'tasks', name)
+            claim = os.path.join(path, 'claimed', name + '.' + worker_id)
+            try:
+                # the claim goes stale starting now. Touch the task before
+                # renaming it, since the claim keeps its modification time,
+                # and should never look stale to `requeue_stale` elsewhere
+                os.utime(task)
+                os.rename(task, claim)
+            except FileNotFoundError:  # claimed by another worker
+                continue
+            try:
+                _compute_task(path, setup, int(name), worker_id)
+            except Exception:
+                # keep the error for the coordinator, and stop
+                with open(os.path.join(path, 'failed', name + '.'
+                                       + worker_id), 'w') as outfile:
+                    outfile.write(traceback.format_exc())
+                os.remove(claim)
+                raise
+            try:
+                os.remove(claim)
+            except FileNotFoundError:  # requeued in the meantime
+                pass
+            n_computed += 1
+            if verbose > 0:
+                print(worker_id + ': task ' + name + ' done.')
+            break
+        else:  # no task left to claim
+            if not os.listdir(_folder(path, 'claimed')):
+                return n_computed
+            requeue_stale(path, stale_timeout)
+            time.sleep(poll)
+
+
+def spawn_workers(path, processes, poll=1.0, stale_timeout=STALE_TIMEOUT):
+    '''
+    Start processes workers on this machine, as separate python processes
+    (see `run_worker`), which can import everything this process can.
+    returns the list of subprocess.Popen objects
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.abspath(entry) for entry in sys.path if entry]
+        + [os.getcwd()])
+    command = [sys.executable, '-m', 'viability', str(path),
+               '--poll', str(poll), '--stale-timeout', str(stale_timeout)]
+    return [subprocess.Popen(command, env=env) for _ in range(processes)]
+
+
+def check_failed(path):
+    '''
+    Raise an error with the traceback of the first failed task of the queue
+    in the folder path, if any.
+    '''
+    failed = sorted(os.listdir(_folder(path, 'failed')))
+    if failed:
+        with open(os.path.join(path, 'failed', failed[0])) as infile:
+            error = infile.read()
+        raise RuntimeError(str(len(failed)) + ' tasks of queue ' + str(path)
+                           + ' failed, e.g. ' + failed[0] + ':\n' + error)
+
+
+def merge_Q_map(path):
+    '''
+    Collect the results of all tasks of the queue in the folder path.
+    returns the same as `compute_Q_map`
+    '''
+    setup = _load_setup(path)
+    grids = setup['grids']
+    n_tasks = -(-setup['total_gridpoints'] // setup['chunk_size'])
+    missing = set(range(n_tasks)) - _results_done(path)
+    if missing:
+        raise ValueError(str(len(missing)) + ' of ' + str(n_tasks)
+                         + ' tasks of queue ' + str(path)
+                         + ' are not done yet.')
+    out = allocate_Q_map(grids, setup['check_grid'], setup['keep_coords'])
+    for idx in range(n_tasks):
+        start, stop = _chunk(setup, idx)
+        with np.load(_result_file(path, idx)) as result:
+            for name, val in out.items():
+                val[..., start:stop] = result[name]
+    return deliver_Q_map(out, grids)
+
+
+def queue_compute_Q_map(grids, p_map, path, processes=None, verbose=0,
+                        check_grid=False, keep_coords=False, chunk_size=None,
+                        batch=False, poll=1.0, stale_timeout=STALE_TIMEOUT,
+                        timeout=None):
+    ''' Compute the transition map of a system with a work queue in the
+    folder path: publish the tasks (see `publish_Q_map`), start local
+    workers, wait until all tasks are done, and merge the results.
+    Workers on other machines can join any time, with
+    `python -m viability <path>`. Rerunning with the same folder resumes.
+    - processes: number of local workers, defaults to the number of CPUs.
+    With 0, only workers started elsewhere compute. If all local workers
+    exit with an error before the tasks are done (e.g. the model cannot be
+    imported), an error is raised instead of waiting for other workers.
+    - poll, stale_timeout: see `run_worker`
+    - timeout: if given, raise an error if the tasks are not done after this
+    many seconds. The queue can then be resumed.
+    - other options: see `compute_Q_map`
+    '''
+    import multiprocessing as mp
+
+    if processes is None:
+        processes = mp.cpu_count()
+    n_tasks = publish_Q_map(path, grids, p_map, check_grid, keep_coords,
+                            chunk_size, batch)
+    if verbose > 0:
+        print('queue ' + str(path) + ': ' + str(len(_results_done(path)))
+              + ' of ' + str(n_tasks) + ' tasks done.')
+    start_time = time.time()
+    workers = spawn_workers(path, processes, poll, stale_timeout)
+    try:
+        n_done = len(_results_done(path))
+        while n_done < n_tasks:
+            check_failed(path)
+            requeue_stale(path, stale_timeout)
+            time.sleep(poll)
+            if verbose > 1:
+                print(str(len(_results_done(path)) - n_done), end=' ')
+            # exit codes first, so that results written just before exiting
+            # are counted
+            codes = [worker.poll() for worker in workers]
+            n_done = len(_results_done(path))
+            if n_done >= n_tasks:
+                break
+            if workers and None not in codes and any(codes):
+                check_failed(path)
+                raise RuntimeError('all local workers of queue ' + str(path)
+                                   + ' exited, with return codes '
+                                   + str(codes) + ', ' + str(n_done)
+                                   + ' of ' + str(n_tasks) + ' tasks done.')
+            if timeout is not None and time.time() - start_time > timeout:
+                raise TimeoutError('queue ' + str(path) + ': only '
+                                   + str(n_done) + ' of ' + str(n_tasks)
+                                   + ' tasks done after ' + str(timeout)
+                                   + ' seconds.')
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+            worker.wait()
+
+    return merge_Q_map(path)